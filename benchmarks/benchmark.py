@@ -0,0 +1,154 @@
+#!/usr/bin/env python
+'''Benchmarks the hot paths of codehunt.datarelease and codehunt.rest on a
+    synthetic data release and a local stub of the REST API, so neither the
+    real data nor API credentials are needed.
+
+    Run from the repository root:
+        python benchmarks/benchmark.py [--users N] [--json]
+'''
+
+import argparse
+import gc
+import json
+import os
+import shutil
+import sys
+import tempfile
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                os.pardir))
+
+import codehunt.datarelease
+import codehunt.rest
+import codehunt.synthetic
+from codehunt.stubserver import StubServer
+
+
+def timed(f):
+    start = time.time()
+    result = f()
+    return time.time() - start, result
+
+def all_attempts(data):
+    return [attempt
+            for user in data.users
+            for level in data.levels
+            for attempt in (user.get_attempts(level) or [])]
+
+def bench_load(directory, results):
+    results['load_seconds'], data = timed(
+            lambda: codehunt.datarelease.Data(directory).users)
+    index_filename = os.path.join(directory, "benchmark-index.sqlite")
+    results['index_build_seconds'], _ = timed(
+            lambda: codehunt.datarelease.Data(directory,
+                                              index=index_filename).users)
+    results['index_load_seconds'], _ = timed(
+            lambda: codehunt.datarelease.Data(directory,
+                                              index=index_filename).users)
+    os.remove(index_filename)
+
+def bench_iteration(directory, results):
+    data = codehunt.datarelease.Data(directory)
+    data.users
+    elapsed, attempts = timed(lambda: all_attempts(data))
+    results['attempts'] = len(attempts)
+    results['get_attempts_us_per_attempt'] = 1e6 * elapsed / len(attempts)
+
+    data = codehunt.datarelease.Data(directory)
+    elapsed, count = timed(lambda: sum(1 for _ in data.iter_attempts()))
+    results['iter_attempts_us_per_attempt'] = 1e6 * elapsed / count
+
+    data = codehunt.datarelease.Data(directory)
+    codehunt.datarelease.text_cache.clear()
+    elapsed, count = timed(lambda: sum(len(attempt.text)
+                                       for attempt in data.iter_attempts()))
+    results['text_us_per_attempt'] = 1e6 * elapsed / results['attempts']
+
+    codehunt.datarelease.text_cache.clear()
+    elapsed, _ = timed(lambda: list(data.load_texts(workers=8)))
+    results['load_texts_us_per_attempt'] = \
+            1e6 * elapsed / results['attempts']
+
+def bench_memory(directory, results):
+    # Everything the release takes up while every attempt of every user is
+    #   held, including Data and the attempt index; the index alone is
+    #   reported separately.
+    for compact in [False, True]:
+        gc.collect()
+        tracemalloc.start()
+        data = codehunt.datarelease.Data(directory, compact=compact)
+        data.users
+        gc.collect()
+        index_size, _ = tracemalloc.get_traced_memory()
+        attempts = all_attempts(data)
+        gc.collect()
+        size, _ = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        key = 'compact_bytes_per_attempt' if compact \
+                else 'bytes_per_attempt'
+        results[key] = size / float(len(attempts))
+        results['index_bytes_per_attempt'] = \
+                index_size / float(len(attempts))
+        del attempts, data
+
+def bench_explore(directory, results, latency, count, concurrency):
+    data = codehunt.datarelease.Data(directory)
+    attempts = []
+    for attempt in data.iter_attempts():
+        attempts.append(attempt)
+        if len(attempts) == count:
+            break
+
+    with StubServer(latency=latency) as server:
+        client = codehunt.rest.Client('benchmark', 'benchmark',
+                                      base_url=server.base_url,
+                                      pool_size=concurrency)
+        elapsed, _ = timed(lambda: [client.explore(attempt)
+                                    for attempt in attempts])
+        results['explorations_per_second_serial'] = len(attempts) / elapsed
+        elapsed, _ = timed(lambda: list(client.explore_many(
+                attempts, concurrency=concurrency)))
+        results['explorations_per_second_concurrent'] = \
+                len(attempts) / elapsed
+        client.close()
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--users', type=int, default=200)
+    parser.add_argument('--attempts-per-level', type=float, default=5)
+    parser.add_argument('--text-size', type=int, default=400)
+    parser.add_argument('--latency', type=float, default=0.005,
+                        help='stub server latency in seconds')
+    parser.add_argument('--explorations', type=int, default=200)
+    parser.add_argument('--concurrency', type=int, default=16)
+    parser.add_argument('--json', action='store_true',
+                        help='print the results as JSON')
+    args = parser.parse_args()
+
+    root = tempfile.mkdtemp(prefix='codehunt-benchmark-')
+    directory = os.path.join(root, 'release')
+    try:
+        results = {}
+        results['generate_seconds'], _ = timed(
+                lambda: codehunt.synthetic.generate_release(
+                    directory, users=args.users,
+                    attempts_per_level=args.attempts_per_level,
+                    text_size=args.text_size))
+        bench_load(directory, results)
+        bench_iteration(directory, results)
+        bench_memory(directory, results)
+        bench_explore(directory, results, args.latency, args.explorations,
+                      args.concurrency)
+    finally:
+        shutil.rmtree(root)
+
+    if args.json:
+        print(json.dumps(results, indent=2, sort_keys=True))
+    else:
+        for key in sorted(results):
+            print("%-40s %12.3f" % (key, results[key]))
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,6 @@
+import sys
+
+from codehunt.cli import main
+
+
+sys.exit(main())
@@ -0,0 +1,176 @@
+'''Reading a data release straight from a zip or tar archive, without
+    extracting it. Use through codehunt.datarelease.Data(archive_path).
+
+    Files inside the archive are given virtual filenames below the archive's
+    own path, e.g. "release.zip/Code Hunt data release 1/users/User001/...",
+    so Level, User and Attempt objects look the same as for an extracted
+    release and their texts share codehunt.datarelease.text_cache.
+'''
+
+import mmap
+import os
+import posixpath
+import struct
+import tarfile
+import threading
+import zipfile
+import zlib
+
+from codehunt import metrics
+from codehunt.datarelease import Level, User, is_user_name, \
+        parse_attempt_filename, release_encoding
+
+
+class ReleaseArchive(object):
+    '''A data release inside an archive. The members are listed once, when
+        the archive is opened, to build the levels and the users' attempt
+        indexes; member contents are only read on demand.
+
+        Subclasses implement _member_names() and _read_member(name).'''
+
+    def __init__(self, path):
+        self.path = path
+        self.levels = []
+        self.users = []
+        self._build_index(self._member_names())
+
+    def __repr__(self):
+        return "%s.%s(%s)" % (type(self).__module__, type(self).__name__,
+                              repr(self.path))
+
+    def close(self):
+        pass
+
+    def _build_index(self, names):
+        # Maps user name to {level name: [AttemptInfo]}
+        users = {}
+        levels = []
+        # The release may be at the top of the archive or in a directory.
+        self.root = None
+        for name in names:
+            parts = name.rstrip('/').split('/')
+            for i, part in enumerate(parts):
+                if part in ('users', 'solutions'):
+                    break
+            else:
+                continue
+            root = '/'.join(parts[:i])
+            if self.root is None:
+                self.root = root
+            elif root != self.root:
+                continue
+            parts = parts[i:]
+
+            if parts[0] == 'solutions' and len(parts) == 2 and \
+                    parts[1].endswith('.challengeId'):
+                levels.append(parts[1])
+            elif parts[0] == 'users' and len(parts) >= 2 and \
+                    is_user_name(parts[1]):
+                attempts = users.setdefault(parts[1], {})
+                if len(parts) == 4:
+                    infos = attempts.setdefault(parts[2], [])
+                    info = parse_attempt_filename(parts[3])
+                    if info is not None:
+                        infos.append(info)
+                elif len(parts) == 3 and name.endswith('/'):
+                    # Level directory entry, possibly with no attempts
+                    attempts.setdefault(parts[2], [])
+
+        base = os.path.join(self.path, *(self.root or '').split('/'))
+        self.levels = [Level(os.path.join(base, 'solutions', level),
+                             read_text=self.read_text)
+                       for level in levels]
+        self.users = [User(os.path.join(base, 'users', user), attempts,
+                           read_text=self.read_text)
+                      for user, attempts in sorted(users.items())]
+
+    def member_name(self, filename):
+        '''The name inside the archive of a virtual filename.'''
+        relative = os.path.relpath(filename, self.path)
+        return posixpath.join(*relative.split(os.sep))
+
+    def read_text(self, filename):
+        '''Reads a member given its virtual filename, decoding it like
+            read_all_text() does a file.'''
+        metrics.registry.increment('codehunt_open_total')
+        data = self._read_member(self.member_name(filename))
+        text = data.decode(release_encoding).replace('\r\n', '\n').replace('\r', '\n')
+        metrics.registry.increment('codehunt_read_chars_total', len(text))
+        return text
+
+class ZipReleaseArchive(ReleaseArchive):
+    '''Release in a zip file. zipfile reads the central directory once;
+        members are then sliced out of a memory map of the file and
+        decompressed directly, so reading one does not cost any system
+        calls.'''
+
+    # Size of the fixed part of a zip local file header
+    _local_header_size = 30
+
+    def __init__(self, path):
+        self._zip = zipfile.ZipFile(path)
+        self._infos = dict((info.filename, info)
+                           for info in self._zip.infolist())
+        self._file = open(path, 'rb')
+        self._map = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+        ReleaseArchive.__init__(self, path)
+
+    def close(self):
+        self._zip.close()
+        self._map.close()
+        self._file.close()
+
+    def _member_names(self):
+        return self._zip.namelist()
+
+    def _read_member(self, name):
+        info = self._infos[name]
+        # Encrypted members and unusual compression methods go the slow way.
+        if info.flag_bits & 0x1 or info.compress_type not in \
+                (zipfile.ZIP_STORED, zipfile.ZIP_DEFLATED):
+            return self._zip.read(name)
+
+        offset = info.header_offset
+        header = self._map[offset:offset + self._local_header_size]
+        if header[:4] != b'PK\x03\x04':
+            raise zipfile.BadZipfile("Bad local header for %s" % name)
+        name_length, extra_length = struct.unpack('<HH', header[26:30])
+        start = offset + self._local_header_size + name_length + extra_length
+        data = self._map[start:start + info.compress_size]
+        if info.compress_type == zipfile.ZIP_DEFLATED:
+            data = zlib.decompress(data, -zlib.MAX_WBITS)
+        if zlib.crc32(data) & 0xffffffff != info.CRC:
+            raise zipfile.BadZipfile("Bad CRC-32 for %s" % name)
+        return data
+
+class TarReleaseArchive(ReleaseArchive):
+    '''Release in a (possibly compressed) tar file. Reading members of a
+        compressed tar file means seeking in the decompressed stream, which
+        is slow; prefer zip or uncompressed tar files.'''
+
+    def __init__(self, path):
+        self._tar = tarfile.open(path)
+        # tarfile objects are not safe to read from several threads.
+        self._lock = threading.Lock()
+        self._members = dict((posixpath.normpath(member.name), member)
+                             for member in self._tar.getmembers())
+        ReleaseArchive.__init__(self, path)
+
+    def close(self):
+        self._tar.close()
+
+    def _member_names(self):
+        return [name + '/' if member.isdir() else name
+                for name, member in self._members.items()]
+
+    def _read_member(self, name):
+        with self._lock:
+            return self._tar.extractfile(self._members[name]).read()
+
+def open_archive(path):
+    '''Opens a zip or tar file containing a data release.'''
+    if zipfile.is_zipfile(path):
+        return ZipReleaseArchive(path)
+    elif tarfile.is_tarfile(path):
+        return TarReleaseArchive(path)
+    raise ValueError("%s is not a zip or tar file" % path)
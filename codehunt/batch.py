@@ -0,0 +1,161 @@
+'''Resumable bulk exploration (or translation) of attempts.
+
+    Results are appended to a JSON lines file, one object per attempt:
+        {"key": "User001/Sector1-Level2/attempt003-...java",
+         "user": "User001", "level": "Sector1-Level2",
+         "attempt": "attempt003-...java",
+         "exp": {...}}
+    where "exp" is the raw response of /explorations (or "translation" the
+    raw response of /translate). The output file doubles as the checkpoint:
+    when a run is restarted, attempts that already have a result for the
+    same operation in the file are skipped, so completed work is never
+    requested again. Explorations and translations may share a file.
+'''
+
+import json
+import logging
+import os
+import time
+
+from codehunt.datarelease import user_name
+from codehunt.rest import map_concurrently
+
+
+logger = logging.getLogger(__name__)
+
+def attempt_key(attempt):
+    '''Identifies an attempt within its data release.'''
+    return '%s/%s/%s' % (user_name(attempt.user), attempt.level.level_name,
+                         os.path.basename(attempt.filename))
+
+# Maps operation to the field holding its results in the output
+result_fields = {
+        'explore': 'exp',
+        'translate': 'translation',
+        }
+
+def read_completed(output_filename, operation='explore'):
+    '''Returns the set of keys with results of operation recorded in
+        output_filename. A partially written last line (e.g. from a crash)
+        is truncated away so the file can be appended to; other lines that
+        cannot be parsed are logged and skipped.'''
+    field = result_fields[operation]
+    completed = set()
+    if not os.path.exists(output_filename):
+        return completed
+
+    good_length = 0
+    with open(output_filename, 'rb+') as f:
+        for number, line in enumerate(f, 1):
+            if not line.endswith(b'\n'):
+                logger.warning("Truncating incomplete last line of %s after "
+                               "%d bytes", output_filename, good_length)
+                f.truncate(good_length)
+                break
+            good_length += len(line)
+            try:
+                result = json.loads(line.decode('utf-8'))
+                if field in result:
+                    completed.add(result['key'])
+            except (ValueError, TypeError, KeyError):
+                logger.warning("Skipping unreadable line %d of %s",
+                               number, output_filename)
+    return completed
+
+    good_length = 0
+    with open(output_filename, 'rb+') as f:
+        for line in f:
+            try:
+                if not line.endswith(b'\n'):
+                    raise ValueError("Incomplete line")
+                result = json.loads(line.decode('utf-8'))
+                if field in result:
+                    completed.add(result['key'])
+            except ValueError:
+                logger.warning("Truncating %s after %d bytes",
+                               output_filename, good_length)
+                f.truncate(good_length)
+                break
+            good_length += len(line)
+    return completed
+
+class BatchRunner(object):
+    '''Explores (or, with operation='translate', translates) attempts with
+        a codehunt.rest.Client, writing results to output_filename.
+
+        Writes are buffered and the file is flushed and fsynced after every
+        sync_every results or sync_interval seconds, whichever comes first.
+        Attempts whose request fails are logged and left out of the output
+        so a later run retries them.'''
+
+    def __init__(self, client, output_filename, operation='explore',
+                 concurrency=8, sync_every=100, sync_interval=5.0):
+        if operation not in result_fields:
+            raise ValueError("operation must be 'explore' or 'translate'")
+        self.client = client
+        self.output_filename = output_filename
+        self.operation = operation
+        self.concurrency = concurrency
+        self.sync_every = sync_every
+        self.sync_interval = sync_interval
+
+        self.completed = 0
+        self.skipped = 0
+        self.failed = 0
+
+    def __repr__(self):
+        return "%s.%s(%s, %s)" % (type(self).__module__, type(self).__name__,
+                                  repr(self.client),
+                                  repr(self.output_filename))
+
+    def _request(self, attempt):
+        if self.operation == 'explore':
+            return self.client.explore(attempt, wait=True).exp
+        return self.client.translate(attempt).translation
+
+    def run(self, attempts):
+        '''Processes every attempt not already in the output file. Returns
+            the number of attempts completed by this run.'''
+        done = read_completed(self.output_filename, self.operation)
+
+        def pending():
+            for attempt in attempts:
+                if attempt_key(attempt) in done:
+                    self.skipped += 1
+                elif self.operation == 'translate' and \
+                        attempt.language != 'Java':
+                    continue
+                else:
+                    yield attempt
+
+        with open(self.output_filename, 'a') as output:
+            unsynced = 0
+            last_sync = time.time()
+            for attempt, future in map_concurrently(self._request, pending(),
+                                                    self.concurrency):
+                try:
+                    result = future.result()
+                except Exception:
+                    self.failed += 1
+                    logger.exception("Failed to %s %s", self.operation,
+                                     attempt_key(attempt))
+                    continue
+
+                output.write(json.dumps({
+                        'key': attempt_key(attempt),
+                        'user': user_name(attempt.user),
+                        'level': attempt.level.level_name,
+                        'attempt': os.path.basename(attempt.filename),
+                        result_fields[self.operation]: result,
+                        }) + '\n')
+                self.completed += 1
+                unsynced += 1
+                if unsynced >= self.sync_every or \
+                        time.time() - last_sync >= self.sync_interval:
+                    output.flush()
+                    os.fsync(output.fileno())
+                    unsynced = 0
+                    last_sync = time.time()
+            output.flush()
+            os.fsync(output.fileno())
+        return self.completed
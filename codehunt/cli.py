@@ -0,0 +1,281 @@
+'''Command-line interface, run as "python -m codehunt" or, once installed,
+    "codehunt".
+
+    python -m codehunt stats RELEASE [filters] [--by level|sector|...]
+        Counts the selected attempts, the users who made them and how many
+        of each won, e.g. how many users won Sector1-Level2 in Java:
+            python -m codehunt stats RELEASE --level Sector1-Level2 \\
+                --language Java
+
+    python -m codehunt export RELEASE OUTPUT [filters] [--text]
+        Writes one row per selected attempt to OUTPUT as CSV, or as JSON
+        lines if OUTPUT ends in .jsonl; "-" writes to standard output.
+
+    python -m codehunt explore RELEASE OUTPUT.jsonl [filters]
+        Explores (or with --translate, translates) the selected attempts,
+        appending results to OUTPUT.jsonl. Rerunning the same command resumes
+        where the previous run stopped. API credentials are read from
+        --client-id/--client-secret or the CODEHUNT_CLIENT_ID and
+        CODEHUNT_CLIENT_SECRET environment variables.
+
+    python -m codehunt pack RELEASE [--output FILE]
+        Packs every text of the release into one file for
+        Data(release, pack=True); see codehunt.textpack.
+
+    All commands use the release's persistent index (see
+    codehunt.releaseindex) and text pack if they exist, so simple queries
+    answer without walking the release. Modules are only imported by the
+    commands that need them to keep startup fast.
+'''
+
+import argparse
+import json
+import logging
+import os
+import signal
+import sys
+
+
+def add_filter_arguments(parser):
+    '''Adds options selecting attempts, matching Data.iter_attempts().'''
+    parser.add_argument('release',
+                        help='data release directory, zip or tar file')
+    parser.add_argument('--level', action='append', dest='levels',
+                        metavar='LEVEL', help='e.g. Sector1-Level2 '
+                        '(may be repeated)')
+    parser.add_argument('--sector', action='append', dest='sectors',
+                        type=int, metavar='N', help='may be repeated')
+    parser.add_argument('--language', action='append', dest='languages',
+                        choices=['Java', 'CSharp'], help='may be repeated')
+    parser.add_argument('--user', action='append', dest='users',
+                        metavar='USER', help='e.g. User001 (may be repeated)')
+    won = parser.add_mutually_exclusive_group()
+    won.add_argument('--won', action='store_true', default=None,
+                     help='only winning attempts')
+    won.add_argument('--lost', action='store_false', dest='won',
+                     help='only attempts that did not win')
+    parser.add_argument('--shard', type=int, default=0, metavar='I',
+                        help='only process shard I of --num-shards')
+    parser.add_argument('--num-shards', type=int, default=1, metavar='N',
+                        help='split the attempts into N shards, e.g. one '
+                        'per machine')
+    index = parser.add_mutually_exclusive_group()
+    index.add_argument('--index', action='store_true', default=None,
+                       help='use (and create if needed) the persistent '
+                       'index of the release; by default it is used only '
+                       'if it exists')
+    index.add_argument('--no-index', action='store_false', dest='index',
+                       help='never use the persistent index')
+
+def load_data(args, compact=False):
+    import codehunt.datarelease
+
+    if not 0 <= args.shard < args.num_shards:
+        sys.exit("--shard must be between 0 and --num-shards - 1")
+    index = args.index
+    pack = None
+    if os.path.isdir(args.release):
+        from codehunt.releaseindex import default_index_filename
+        from codehunt.textpack import default_pack_path
+
+        if index is None:
+            index = os.path.exists(os.path.join(args.release,
+                                                default_index_filename))
+        if os.path.exists(default_pack_path(args.release)):
+            pack = True
+    return codehunt.datarelease.Data(args.release, index=index,
+                                     compact=compact, shard=args.shard,
+                                     num_shards=args.num_shards, pack=pack)
+
+def select_attempts(data, args):
+    return data.iter_attempts(levels=args.levels, sectors=args.sectors,
+                              languages=args.languages, won=args.won,
+                              users=args.users)
+
+def explore(args):
+    import codehunt.batch
+    import codehunt.rest
+
+    client_id = args.client_id or os.environ.get('CODEHUNT_CLIENT_ID')
+    client_secret = args.client_secret or \
+            os.environ.get('CODEHUNT_CLIENT_SECRET')
+    if not client_id or not client_secret:
+        sys.exit("explore needs --client-id and --client-secret (or the "
+                 "CODEHUNT_CLIENT_ID and CODEHUNT_CLIENT_SECRET environment "
+                 "variables)")
+
+    cache = None
+    if args.cache:
+        import codehunt.resultcache
+        cache = codehunt.resultcache.ResultCache(args.cache)
+
+    data = load_data(args)
+    client = codehunt.rest.Client(client_id, client_secret,
+                                  pool_size=args.concurrency,
+                                  base_url=args.base_url, cache=cache,
+                                  rate_limit=args.rate_limit)
+    runner = codehunt.batch.BatchRunner(
+            client, args.output,
+            operation='translate' if args.translate else 'explore',
+            concurrency=args.concurrency)
+    try:
+        runner.run(select_attempts(data, args))
+    finally:
+        client.close()
+    print("%d completed, %d already done, %d failed" %
+          (runner.completed, runner.skipped, runner.failed))
+    return 1 if runner.failed else 0
+
+def stats(args):
+    from codehunt.datarelease import user_name
+
+    group_keys = {
+            None: lambda attempt: 'total',
+            'level': lambda attempt: attempt.level.level_name,
+            'sector': lambda attempt: 'Sector%d' % attempt.level.sector_num,
+            'language': lambda attempt: attempt.language,
+            'user': lambda attempt: user_name(attempt.user),
+            }
+    group_key = group_keys[args.by]
+
+    # Maps group to [attempts, winning attempts, users, users who won]
+    groups = {}
+    for attempt in select_attempts(load_data(args, compact=True), args):
+        group = groups.get(group_key(attempt))
+        if group is None:
+            group = groups[group_key(attempt)] = [0, 0, set(), set()]
+        name = user_name(attempt.user)
+        group[0] += 1
+        group[2].add(name)
+        if attempt.won:
+            group[1] += 1
+            group[3].add(name)
+
+    columns = ['attempts', 'won', 'users', 'users_won']
+    if args.by is None:
+        counts = groups.get('total', [0, 0, (), ()])
+        for column, count in zip(columns, counts):
+            print("%-10s %d" % (column, count if isinstance(count, int)
+                                        else len(count)))
+        return 0
+
+    width = max([len(args.by)] + [len(name) for name in groups])
+    print("%-*s %10s %10s %10s %10s" % tuple([width, args.by] + columns))
+    for name, (attempts, won, users, winners) in sorted(groups.items()):
+        print("%-*s %10d %10d %10d %10d" % (width, name, attempts, won,
+                                            len(users), len(winners)))
+    return 0
+
+export_fields = ['user', 'level', 'attempt_num', 'timestamp', 'won',
+                 'rating', 'language', 'filename']
+
+def export(args):
+    from codehunt.datarelease import user_name
+
+    fields = export_fields + (['text'] if args.text else [])
+    jsonl = args.format == 'jsonl' or \
+            (args.format is None and args.output.endswith('.jsonl'))
+    if args.output == '-':
+        output = sys.stdout
+    elif jsonl or sys.version_info[0] < 3:
+        output = open(args.output, 'w' if jsonl else 'wb')
+    else:
+        output = open(args.output, 'w', newline='')
+
+    try:
+        if jsonl:
+            def write(row):
+                output.write(json.dumps(dict(zip(fields, row))) + '\n')
+        else:
+            import csv
+
+            writer = csv.writer(output)
+            writer.writerow(fields)
+            write = writer.writerow
+
+        count = 0
+        for attempt in select_attempts(load_data(args, compact=True), args):
+            row = [user_name(attempt.user), attempt.level.level_name,
+                   attempt.attempt_num, attempt.timestamp.isoformat(),
+                   attempt.won, attempt.rating, attempt.language,
+                   attempt.filename]
+            if args.text:
+                row.append(attempt.text)
+            write(row)
+            count += 1
+    finally:
+        if output is not sys.stdout:
+            output.close()
+    if output is not sys.stdout:
+        print("Exported %d attempts to %s" % (count, args.output))
+    return 0
+
+def pack(args):
+    import codehunt.datarelease
+    import codehunt.textpack
+
+    data = codehunt.datarelease.Data(args.release)
+    count = codehunt.textpack.pack_texts(data, args.output)
+    print("Packed %d files into %s" % (count, args.output or
+            codehunt.textpack.default_pack_path(args.release)))
+    return 0
+
+def make_parser():
+    parser = argparse.ArgumentParser(prog='python -m codehunt',
+            description='Tools for the Code Hunt data release.')
+    subparsers = parser.add_subparsers(dest='command')
+    subparsers.required = True
+
+    stats_parser = subparsers.add_parser('stats',
+            help='count attempts, users and wins')
+    add_filter_arguments(stats_parser)
+    stats_parser.add_argument('--by',
+            choices=['level', 'sector', 'language', 'user'],
+            help='one row of counts per level, sector, ...')
+    stats_parser.set_defaults(function=stats)
+
+    export_parser = subparsers.add_parser('export',
+            help='write the selected attempts as CSV or JSON lines')
+    add_filter_arguments(export_parser)
+    export_parser.add_argument('output',
+            help='file to write, or - for standard output')
+    export_parser.add_argument('--format', choices=['csv', 'jsonl'],
+            help='default: jsonl if output ends in .jsonl, otherwise csv')
+    export_parser.add_argument('--text', action='store_true',
+            help='include the source text of each attempt')
+    export_parser.set_defaults(function=export)
+
+    explore_parser = subparsers.add_parser('explore',
+            help='explore attempts with the REST API, resumably')
+    add_filter_arguments(explore_parser)
+    explore_parser.add_argument('output', help='JSON lines file to append to')
+    explore_parser.add_argument('--translate', action='store_true',
+            help='translate Java attempts to C# instead of exploring')
+    explore_parser.add_argument('--concurrency', type=int, default=8)
+    explore_parser.add_argument('--rate-limit', type=float, metavar='N',
+            help='send at most N requests per second')
+    explore_parser.add_argument('--cache', metavar='FILE',
+            help='ResultCache file for reusing results across runs')
+    explore_parser.add_argument('--client-id')
+    explore_parser.add_argument('--client-secret')
+    explore_parser.add_argument('--base-url', help=argparse.SUPPRESS)
+    explore_parser.set_defaults(function=explore)
+
+    pack_parser = subparsers.add_parser('pack',
+            help='pack the texts of a release into one file')
+    pack_parser.add_argument('release',
+                             help='data release directory, zip or tar file')
+    pack_parser.add_argument('--output', metavar='FILE',
+            help='pack file to write (default: inside the release '
+            'directory)')
+    pack_parser.set_defaults(function=pack)
+
+    return parser
+
+def main(argv=None):
+    # Exit quietly when output is piped into e.g. head.
+    if hasattr(signal, 'SIGPIPE'):
+        signal.signal(signal.SIGPIPE, signal.SIG_DFL)
+    logging.basicConfig(level=logging.WARNING)
+    args = make_parser().parse_args(argv)
+    return args.function(args)
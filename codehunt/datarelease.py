@@ -1,9 +1,19 @@
+import array
+import bisect
+import calendar
 import collections
 import datetime
 import functools
 import glob
+import io
 import os
 import re
+import sys
+import threading
+import time
+import zlib
+
+from codehunt import metrics
 
 
 # Not in Python 2.x
@@ -75,19 +85,133 @@ else:
         # Return the decorator wrapping the class (also wraps the instance to maintain the docstring and the name of the original function):
         return functools.wraps(input_func)(_Cache_class(input_func))
 
+# Not in Python < 3.5
+if hasattr(os, 'scandir'):
+    _scandir = os.scandir
+else:
+    class _DirEntry(object):
+        """Minimal stand-in for os.DirEntry built on os.listdir()."""
+
+        def __init__(self, directory, name):
+            self.name = name
+            self.path = os.path.join(directory, name)
+
+        def is_dir(self):
+            return os.path.isdir(self.path)
+
+        def is_file(self):
+            return os.path.isfile(self.path)
+
+        def stat(self):
+            return os.stat(self.path)
+
+    def _scandir(directory):
+        return [_DirEntry(directory, name) for name in os.listdir(directory)]
+
+def scandir(directory):
+    metrics.registry.increment('codehunt_listdir_total')
+    return _scandir(directory)
+
 def memoized_property(f):
     return property(memoized(f))
 
+# Encoding of the texts of a release, whatever the locale, so a release
+#   reads the same from a directory as from an archive (see codehunt.archive)
+release_encoding = 'utf-8'
+
 def read_all_text(filename):
-    with open(filename, "r") as f:
-        return f.read()
+    metrics.registry.increment('codehunt_open_total')
+    with io.open(filename, "r", encoding=release_encoding) as f:
+        text = f.read()
+    metrics.registry.increment('codehunt_read_chars_total', len(text))
+    return text
+
+class TextCache(object):
+    '''Cache of file contents with least-recently-used eviction once the
+        cached strings take up more than max_bytes of memory. Unlike
+        memoized_property, entries are keyed by filename, so caching a text
+        does not keep the object it was read for alive.'''
+
+    def __init__(self, max_bytes=64 * 1024 * 1024):
+        self.max_bytes = max_bytes
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._entries = collections.OrderedDict()
+        self._lock = threading.Lock()
+
+    def __repr__(self):
+        return "%s.%s(%s)" % (type(self).__module__, type(self).__name__,
+                              repr(self.max_bytes))
+
+    def __len__(self):
+        return len(self._entries)
+
+    def get(self, filename, read=read_all_text):
+        '''Returns the contents of filename, calling read(filename) to load
+            them if they are not cached.'''
+        with self._lock:
+            text = self._entries.pop(filename, None)
+            if text is not None:
+                self._entries[filename] = text
+                self.hits += 1
+                metrics.registry.increment('codehunt_text_cache_total',
+                                           result='hit')
+                return text
+            self.misses += 1
+        metrics.registry.increment('codehunt_text_cache_total',
+                                   result='miss')
+
+        text = read(filename)
+        self.put(filename, text)
+        return text
+
+    def put(self, filename, text):
+        size = sys.getsizeof(text)
+        if size > self.max_bytes:
+            return
+        with self._lock:
+            old = self._entries.pop(filename, None)
+            if old is not None:
+                self.size -= sys.getsizeof(old)
+            while self._entries and self.size + size > self.max_bytes:
+                _, evicted = self._entries.popitem(last=False)
+                self.size -= sys.getsizeof(evicted)
+                self.evictions += 1
+                metrics.registry.increment('codehunt_text_cache_total',
+                                           result='eviction')
+            self._entries[filename] = text
+            self.size += size
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self.size = 0
+
+    def stats(self):
+        with self._lock:
+            return {
+                    'entries': len(self._entries),
+                    'bytes': self.size,
+                    'max_bytes': self.max_bytes,
+                    'hits': self.hits,
+                    'misses': self.misses,
+                    'evictions': self.evictions,
+                    }
+
+# Shared by Attempt.text, Level.challenge_text and User.experience. Adjust
+#   text_cache.max_bytes to change its budget.
+text_cache = TextCache()
 
 
 class Level(object):
     level_name_re = re.compile(r"Sector(?P<sector>\d)-Level(?P<level>\d)")
 
-    def __init__(self, challenge_id_filename):
+    def __init__(self, challenge_id_filename, read_text=read_all_text):
         self.challenge_id_filename = challenge_id_filename
+        # Function reading a file of the release, e.g. from an archive
+        self.read_text = read_text
         basename = os.path.basename(challenge_id_filename)
         self.level_name = os.path.splitext(basename)[0]
 
@@ -104,18 +228,33 @@ class Level(object):
 
     @memoized_property
     def challenge_id(self):
-        return read_all_text(self.challenge_id_filename)
+        return self.read_text(self.challenge_id_filename)
 
-    @memoized_property
+    @property
     def challenge_text(self):
         filename = os.path.splitext(self.challenge_id_filename)[0] + ".cs"
-        return read_all_text(filename)
+        return text_cache.get(filename, self.read_text)
 
 def load_levels(directory):
+    metrics.registry.increment('codehunt_listdir_total')
     files = glob.glob(os.path.join(directory, "solutions", "*.challengeId"))
     return [Level(f) for f in files]
 
-class Attempt(object):
+# Everything that can be learned about an attempt from its filename alone.
+#   epoch is the timestamp in seconds since 1970-01-01 UTC and rating is None
+#   for attempts that did not win.
+AttemptInfo = collections.namedtuple('AttemptInfo',
+        ['name', 'attempt_num', 'epoch', 'rating', 'language_ext'])
+
+epoch_start = datetime.datetime(1970, 1, 1, tzinfo=tzinfo_utc)
+
+class AttemptBase(object):
+    '''Behaviour shared by Attempt and CompactAttempt. Subclasses provide the
+        user, level, filename, attempt_num, timestamp, won, rating,
+        language_ext and language attributes.'''
+
+    __slots__ = ()
+
     #Format: attemptNNN-YYYYMMDD-HHMMSS[-winningR].(java|cs)
     attempt_filename_re = re.compile(r"attempt(?P<attemptNum>[0-9]{3})-(?P<year>[0-9]{4})(?P<month>[0-9]{2})(?P<day>[0-9]{2})-(?P<hour>[0-9]{2})(?P<minute>[0-9]{2})(?P<second>[0-9]{2})(-winning(?P<rating>[1-3]))?.(?P<ext>java|cs)")
     language_ext_dict = {
@@ -123,56 +262,320 @@ class Attempt(object):
             'java': 'Java',
             }
 
-    def __init__(self, user, level, attempt_filename):
+    def __repr__(self):
+        return "%s.%s(%s, %s, %s)" % (type(self).__module__,
+                                      type(self).__name__,
+                                      repr(self.user),
+                                      repr(self.level),
+                                      repr(self.filename))
+
+    def __str__(self):
+        return "{%s %s %s %s}" % (type(self).__name__, str(self.user),
+                                  str(self.level),
+                                  str(os.path.basename(self.filename)))
+
+    # get_attempts() and iter_attempts() build new objects on every call, so
+    #   attempts compare equal if they are the same attempt file.
+    def _key(self):
+        return (self.user.directory, self.level.level_name, self.filename)
+
+    def __eq__(self, other):
+        if not isinstance(other, AttemptBase):
+            return NotImplemented
+        return self._key() == other._key()
+
+    def __ne__(self, other):
+        if not isinstance(other, AttemptBase):
+            return NotImplemented
+        return self._key() != other._key()
+
+    def __hash__(self):
+        return hash(self._key())
+
+    @property
+    def text(self):
+        return text_cache.get(self.filename, self.user.read_text)
+
+class Attempt(AttemptBase):
+    def __init__(self, user, level, attempt_filename, info=None):
+        '''info is the AttemptInfo of the attempt or its position in
+            user.attempt_index; attempt_filename may then be None.'''
         self.user = user
         self.level = level
-        self.filename = attempt_filename
-
-        match = self.attempt_filename_re.match(os.path.basename(self.filename))
 
-        self.attempt_num = int(match.group('attemptNum'))
+        if info is None:
+            info = parse_attempt_filename(os.path.basename(attempt_filename))
+        elif not isinstance(info, AttemptInfo):
+            info = user.attempt_index.info(info)
+        if attempt_filename is None:
+            attempt_filename = os.path.join(user.directory, level.level_name,
+                                            info.name)
+        self.filename = attempt_filename
 
-        year = int(match.group('year'))
-        month = int(match.group('month'))
-        day = int(match.group('day'))
-        hour = int(match.group('hour'))
-        minute = int(match.group('minute'))
-        second = int(match.group('second'))
-        self.timestamp = datetime.datetime(year, month, day,
-                                           hour, minute, second,
-                                           tzinfo=tzinfo_utc)
+        self.attempt_num = info.attempt_num
+        # timestamp as seconds since 1970-01-01 UTC
+        self.epoch = info.epoch
+        self.timestamp = epoch_start + datetime.timedelta(seconds=info.epoch)
 
-        if match.group('rating'):
+        if info.rating is not None:
             self.won = True
-            self.rating = int(match.group('rating'))
+            self.rating = info.rating
         else:
             self.won = False
             self.rating = None
 
         # "java" or "cs"
-        self.language_ext = match.group('ext')
+        self.language_ext = info.language_ext
         # "Java" or "CSharp" (language names used by REST API)
         self.language = self.language_ext_dict[self.language_ext]
 
+class CompactAttempt(AttemptBase):
+    '''Drop-in replacement for Attempt for holding very many attempts in
+        memory. Instead of a __dict__ of decoded values it only keeps
+        references to its user and level and its position in the user's
+        AttemptIndex (or an AttemptInfo if the user has no index); every
+        other attribute is read from the index on access, e.g. timestamp
+        only becomes a datetime when it is read.'''
+
+    __slots__ = ('user', 'level', '_info')
+
+    def __init__(self, user, level, attempt_filename, info=None):
+        self.user = user
+        self.level = level
+        if info is None:
+            info = parse_attempt_filename(os.path.basename(attempt_filename))
+        self._info = info
+
+    @property
+    def info(self):
+        '''The AttemptInfo of this attempt.'''
+        if isinstance(self._info, AttemptInfo):
+            return self._info
+        return self.user.attempt_index.info(self._info)
+
+    @property
+    def filename(self):
+        return os.path.join(self.user.directory, self.level.level_name,
+                            self.info.name)
+
+    @property
+    def attempt_num(self):
+        if isinstance(self._info, AttemptInfo):
+            return self._info.attempt_num
+        return self.user.attempt_index.attempt_nums[self._info]
+
+    @property
+    def epoch(self):
+        if isinstance(self._info, AttemptInfo):
+            return self._info.epoch
+        return self.user.attempt_index.epochs[self._info]
+
+    @property
+    def timestamp(self):
+        return epoch_start + datetime.timedelta(seconds=self.epoch)
+
+    @property
+    def won(self):
+        return self.rating is not None
+
+    @property
+    def rating(self):
+        if isinstance(self._info, AttemptInfo):
+            return self._info.rating
+        return self.user.attempt_index.rating(self._info)
+
+    @property
+    def language_ext(self):
+        if isinstance(self._info, AttemptInfo):
+            return self._info.language_ext
+        return self.user.attempt_index.language_ext(self._info)
+
+    @property
+    def language(self):
+        return self.language_ext_dict[self.language_ext]
+
+def parse_attempt_filename(name):
+    '''Parses an attempt filename (without its directory) into an
+        AttemptInfo. Returns None if name is not an attempt filename.'''
+    match = AttemptBase.attempt_filename_re.match(name)
+    if match is None:
+        return None
+
+    epoch = calendar.timegm((int(match.group('year')),
+                             int(match.group('month')),
+                             int(match.group('day')),
+                             int(match.group('hour')),
+                             int(match.group('minute')),
+                             int(match.group('second'))))
+    rating = match.group('rating')
+
+    return AttemptInfo(name, int(match.group('attemptNum')), epoch,
+                       int(rating) if rating else None, match.group('ext'))
+
+def scan_user_directory(user_directory, level_filter=None):
+    '''Lists every level directory of a user and parses the attempt filenames
+        in each. Returns a dict mapping level names to lists of AttemptInfo.
+        If level_filter is given, only level directories whose names it
+        returns True for are listed.'''
+    attempts = {}
+    for level_entry in scandir(user_directory):
+        if (level_filter is None or level_filter(level_entry.name)) and \
+                level_entry.is_dir():
+            infos = []
+            for entry in scandir(level_entry.path):
+                info = parse_attempt_filename(entry.name)
+                if info is not None:
+                    infos.append(info)
+            attempts[level_entry.name] = infos
+    return attempts
+
+# Not in Python 2.x
+try:
+    array.array('q')
+    _epoch_typecode = 'q'
+except ValueError:
+    _epoch_typecode = 'l'
+
+# Level names are shared by the indexes of all users.
+_shared_level_names = {}
+
+class AttemptIndex(object):
+    '''The attempts of one user in a few flat arrays, one entry per attempt:
+        attempt_nums, epochs, ratings (0 for attempts that did not win) and
+        language_codes (indexes into language_exts). The attempts of each
+        level are consecutive, from position start to stop - 1 as given by
+        span(level_name).
+
+        Also behaves like a read-only dict mapping level names to lists of
+        AttemptInfo, as returned by scan_user_directory(), but those are
+        built on every access. Attempt filenames are not stored unless they
+        differ from the one rebuilt from the other fields.'''
+
+    __slots__ = ('_level_names', '_starts', 'attempt_nums', 'epochs',
+                 'ratings', 'language_codes', '_names')
+
+    language_exts = ['cs', 'java']
+
+    def __init__(self, attempts=()):
+        '''attempts is a dict mapping level names to lists of AttemptInfo,
+            or an iterable of (level name, list of AttemptInfo) pairs.'''
+        self._level_names = ()
+        # Start of each level, followed by the number of attempts
+        self._starts = array.array('l', [0])
+        self.attempt_nums = array.array('H')
+        self.epochs = array.array(_epoch_typecode)
+        self.ratings = array.array('b')
+        self.language_codes = array.array('b')
+        # Maps position to filename for filenames that cannot be rebuilt
+        self._names = None
+        if hasattr(attempts, 'items'):
+            attempts = attempts.items()
+        for level_name, infos in attempts:
+            self.add(level_name, infos)
+
     def __repr__(self):
-        return "%s.%s(%s, %s, %s)" % (type(self).__module__,
-                                      type(self).__name__,
-                                      repr(self.user),
-                                      repr(self.level),
-                                      repr(self.filename))
+        return "%s.%s(%s)" % (type(self).__module__, type(self).__name__,
+                              repr(dict(self.items())))
 
-    def __str__(self):
-        return "{%s %s %s %s}" % (type(self).__name__, str(self.user),
-                                  str(self.level),
-                                  str(os.path.basename(self.filename)))
+    def add(self, level_name, infos):
+        '''Appends the attempts of a level that is not in the index yet.'''
+        if level_name in self._level_names:
+            raise ValueError("%s is already in the index" % level_name)
+        for info in infos:
+            position = len(self.epochs)
+            self.attempt_nums.append(info.attempt_num)
+            self.epochs.append(info.epoch)
+            self.ratings.append(info.rating or 0)
+            self.language_codes.append(
+                    self.language_exts.index(info.language_ext))
+            if self.name(position) != info.name:
+                if self._names is None:
+                    self._names = {}
+                self._names[position] = info.name
+        level_name = _shared_level_names.setdefault(level_name, level_name)
+        self._level_names += (level_name,)
+        self._starts.append(len(self.epochs))
 
-    @memoized_property
-    def text(self):
-        return read_all_text(self.filename)
+    def span(self, level_name):
+        '''(start, stop) of the positions of the attempts on a level. Raises
+            KeyError if the level is not in the index.'''
+        try:
+            i = self._level_names.index(level_name)
+        except ValueError:
+            raise KeyError(level_name)
+        return self._starts[i], self._starts[i + 1]
+
+    def rating(self, position):
+        return self.ratings[position] or None
+
+    def language_ext(self, position):
+        return self.language_exts[self.language_codes[position]]
+
+    def name(self, position):
+        '''The filename (without its directory) of the attempt at
+            position.'''
+        if self._names is not None and position in self._names:
+            return self._names[position]
+        rating = self.ratings[position]
+        return "attempt%03d-%s%s.%s" % (
+                self.attempt_nums[position],
+                time.strftime('%Y%m%d-%H%M%S',
+                              time.gmtime(self.epochs[position])),
+                '-winning%d' % rating if rating else '',
+                self.language_ext(position))
+
+    def info(self, position):
+        '''The AttemptInfo of the attempt at position.'''
+        return AttemptInfo(self.name(position), self.attempt_nums[position],
+                           self.epochs[position], self.rating(position),
+                           self.language_ext(position))
+
+    def __len__(self):
+        return len(self._level_names)
+
+    def __iter__(self):
+        return iter(self._level_names)
+
+    def __contains__(self, level_name):
+        return level_name in self._level_names
+
+    def __getitem__(self, level_name):
+        start, stop = self.span(level_name)
+        return [self.info(position) for position in range(start, stop)]
+
+    def get(self, level_name, default=None):
+        if level_name not in self._level_names:
+            return default
+        return self[level_name]
+
+    def keys(self):
+        return list(self._level_names)
+
+    def values(self):
+        return [self[level_name] for level_name in self._level_names]
+
+    def items(self):
+        return [(level_name, self[level_name])
+                for level_name in self._level_names]
 
 class User(object):
-    def __init__(self, user_directory):
+    # Class used for the values returned by get_attempts(); set to
+    #   CompactAttempt to save memory.
+    attempt_class = Attempt
+
+    def __init__(self, user_directory, attempt_index=None,
+                 read_text=read_all_text):
         self.directory = user_directory
+        # Optional AttemptIndex of the attempts of the user, also given as
+        #   a dict mapping level names to lists of AttemptInfo as returned
+        #   by scan_user_directory(). When present, get_attempts() answers
+        #   from it instead of going to the filesystem.
+        if attempt_index is not None and \
+                not isinstance(attempt_index, AttemptIndex):
+            attempt_index = AttemptIndex(attempt_index)
+        self.attempt_index = attempt_index
+        # Function reading a file of the release, e.g. from an archive
+        self.read_text = read_text
 
     def __repr__(self):
         return "%s.%s(%s)" % (type(self).__module__, type(self).__name__,
@@ -181,26 +584,516 @@ class User(object):
     def __str__(self):
         return "{%s %s}" % (type(self).__name__, self.directory[-3:])
 
-    @memoized_property
+    @property
     def experience(self):
         filename = os.path.join(self.directory, "experience")
-        return read_all_text(filename)
+        return text_cache.get(filename, self.read_text)
 
-    @memoized
     def get_attempts(self, level):
+        '''The attempts of the user on level, or None if the user has no
+            directory for it. With an attempt index the attempts are built
+            from it on every call, as they take far more memory than the
+            index; otherwise the directory listing is memoized.'''
+        if self.attempt_index is None:
+            return self._list_attempts(level)
+        try:
+            start, stop = self.attempt_index.span(level.level_name)
+        except KeyError:
+            return None
+        return [self.attempt_class(self, level, None, position)
+                for position in range(start, stop)]
+
+    @memoized
+    def _list_attempts(self, level):
         directory = os.path.join(self.directory, level.level_name)
+        metrics.registry.increment('codehunt_stat_total')
         if os.path.exists(directory):
-            return [Attempt(self, level, os.path.join(directory, f))
+            metrics.registry.increment('codehunt_listdir_total')
+            return [self.attempt_class(self, level,
+                                       os.path.join(directory, f))
                     for f in os.listdir(directory)]
         else:
             return None
 
+user_name_re = re.compile(r"User[0-9]+$")
+
+def is_user_name(name):
+    '''Whether name is that of a user directory: "User" followed by the
+        user's number (see user_number()).'''
+    return user_name_re.match(name) is not None
+
 def load_users(directory):
+    metrics.registry.increment('codehunt_listdir_total')
     users = glob.glob(os.path.join(directory, "users", "User*"))
-    return [User(u) for u in users]
+    return [User(u) for u in users if is_user_name(os.path.basename(u))]
+
+def _memo_counters():
+    '''Reports the hits and misses of the memoized functions to
+        codehunt.metrics.'''
+    counters = {}
+    for name, function in [('Level.challenge_id', Level.challenge_id.fget),
+                           ('User.get_attempts', User._list_attempts)]:
+        # Only functools.lru_cache keeps statistics.
+        if hasattr(function, 'cache_info'):
+            info = function.cache_info()
+            for result, value in [('hit', info.hits), ('miss', info.misses)]:
+                labels = (('function', name), ('result', result))
+                counters[('codehunt_memo_total', labels)] = value
+    return counters
+
+metrics.registry.add_collector(_memo_counters)
+
+def index_users(directory, level_filter=None):
+    '''Like load_users(), but walks the whole users tree once up front so
+        User.get_attempts() never has to touch the filesystem. If
+        level_filter is given, only the level directories for which
+        level_filter(user name, level name) is True are listed.'''
+    users = []
+    for entry in scandir(os.path.join(directory, "users")):
+        if is_user_name(entry.name) and entry.is_dir():
+            if level_filter is None:
+                attempts = scan_user_directory(entry.path)
+            else:
+                attempts = scan_user_directory(entry.path,
+                        functools.partial(level_filter, entry.name))
+            users.append(User(entry.path, attempts))
+    return users
+
+def load_indexed_users(directory, index_filename=None):
+    '''Like index_users(), but backed by a persistent ReleaseIndex.'''
+    from codehunt.releaseindex import ReleaseIndex
+
+    index = ReleaseIndex(directory, index_filename)
+    try:
+        attempts = index.load()
+    finally:
+        index.close()
+    users_directory = os.path.join(directory, "users")
+    return [User(os.path.join(users_directory, name), attempt_index)
+            for name, attempt_index in sorted(attempts.items())]
+
+def to_epoch(timestamp):
+    '''Converts a datetime (naive ones are taken to be UTC) to seconds since
+        1970-01-01 UTC. Numbers are returned unchanged.'''
+    if isinstance(timestamp, datetime.datetime):
+        return calendar.timegm(timestamp.utctimetuple())
+    return timestamp
+
+class Timeline(object):
+    '''Attempts in time order (ties broken by attempt_num) supporting
+        logarithmic-time queries for the attempts in a time window.'''
+
+    def __init__(self, attempts):
+        self.attempts = sorted(attempts,
+                key=lambda attempt: (attempt.epoch, attempt.attempt_num))
+        self.epochs = [attempt.epoch for attempt in self.attempts]
+
+        self.first_win_index = None
+        for i, attempt in enumerate(self.attempts):
+            if attempt.won:
+                self.first_win_index = i
+                break
+
+    def __repr__(self):
+        return "%s.%s(%s)" % (type(self).__module__, type(self).__name__,
+                              repr(self.attempts))
+
+    def __len__(self):
+        return len(self.attempts)
+
+    def __iter__(self):
+        return iter(self.attempts)
+
+    def __getitem__(self, index):
+        return self.attempts[index]
+
+    def _range(self, since, until):
+        start = 0
+        if since is not None:
+            start = bisect.bisect_left(self.epochs, to_epoch(since))
+        end = len(self.epochs)
+        if until is not None:
+            end = bisect.bisect_left(self.epochs, to_epoch(until))
+        return start, end
+
+    def between(self, since=None, until=None):
+        '''Attempts with since <= timestamp < until, where either bound may
+            be None, a datetime or seconds since 1970-01-01 UTC.'''
+        start, end = self._range(since, until)
+        return self.attempts[start:end]
+
+    def count_between(self, since=None, until=None):
+        start, end = self._range(since, until)
+        return max(end - start, 0)
+
+    @property
+    def first_win(self):
+        '''The earliest winning attempt, or None.'''
+        if self.first_win_index is None:
+            return None
+        return self.attempts[self.first_win_index]
+
+    @property
+    def solve_duration(self):
+        '''timedelta from the first attempt to the first winning attempt, or
+            None if no attempt won. Most meaningful for a single user and
+            level.'''
+        if self.first_win_index is None:
+            return None
+        return datetime.timedelta(seconds=self.epochs[self.first_win_index]
+                                          - self.epochs[0])
+
+def user_name(user):
+    '''The directory name ("User...") of a User or of a user directory.'''
+    if isinstance(user, User):
+        user = user.directory
+    return os.path.basename(os.path.normpath(user))
+
+def user_number(user):
+    '''The number NNN of the user directory "UserNNN" of a User or of a user
+        directory; unlike positions in Data.users, the same in every run.'''
+    return int(user_name(user)[len("User"):])
+
+def shard_of(user, level_name, num_shards):
+    '''The shard (0 to num_shards - 1) holding the attempts of user (a User
+        or user directory name) on a level. The same on every machine and
+        Python version.'''
+    key = '%s/%s' % (user_name(user), level_name)
+    return (zlib.crc32(key.encode('utf-8')) & 0xffffffff) % num_shards
 
 class Data(object):
-    def __init__(self, directory):
+    def __init__(self, directory, index=None, compact=False, shard=0,
+                 num_shards=1, pack=None):
+        '''If index is True, the parsed attempt filenames are kept in a
+            persistent index file inside directory so later runs only rescan
+            user directories that changed. index may also be the filename to
+            use for the index, e.g. if directory is read-only.
+
+            If compact is True, users return CompactAttempt objects instead
+            of Attempt objects.
+
+            The users tree is only walked when users is first accessed, so
+            iter_attempts() can stream a filtered subset without indexing
+            the whole release.
+
+            directory may also be a zip or tar file containing the release
+            (see codehunt.archive), in which case index is ignored.
+
+            To split the work on a release between num_shards processes or
+            machines, give each a different shard from 0 to num_shards - 1.
+            The attempts of each user on each level then belong to exactly
+            one shard (see shard_of()), and users, iter_attempts() and
+            everything built on them only see that shard's attempts. Only
+            the shard's own level directories are listed. Users have many
+            levels each, so the shards end up with similar numbers of
+            attempts even though some users have far more than others.
+
+            If pack is True, or the filename of a pack written by
+            codehunt.textpack.pack_texts(), texts are read from that pack
+            instead of from individual files; it is then available as
+            self.pack. Files changed since the pack was written are still
+            read from the release; set self.pack.verify to False to skip
+            that check if the release does not change.'''
+        if not 0 <= shard < num_shards:
+            raise ValueError("shard must be between 0 and num_shards - 1")
         self.directory = directory
-        self.levels = load_levels(directory)
-        self.users = load_users(directory)
+        self.index = index
+        self.compact = compact
+        self.shard = shard
+        self.num_shards = num_shards
+        self._users = None
+        if os.path.isfile(directory):
+            from codehunt.archive import open_archive
+
+            self.archive = open_archive(directory)
+            # Function reading a file of the release itself
+            self.read_release_file = self.archive.read_text
+            self.index = None
+            self.levels = self.archive.levels
+            self._users = self.archive.users
+            if num_shards > 1:
+                self._restrict_to_shard(self._users)
+            if compact:
+                for user in self._users:
+                    user.attempt_class = CompactAttempt
+        else:
+            self.archive = None
+            self.read_release_file = read_all_text
+            self.levels = load_levels(directory)
+
+        self.pack = None
+        # Function reading texts for levels and users
+        self.read_text = self.read_release_file
+        if pack:
+            from codehunt.textpack import PackedTextStore, default_pack_path
+
+            self.pack = PackedTextStore(
+                    default_pack_path(directory) if pack is True else pack,
+                    directory, fallback=self.read_release_file)
+            self.read_text = self.pack.read_text
+            for level in self.levels:
+                level.read_text = self.read_text
+            for user in self._users or ():
+                user.read_text = self.read_text
+        # Maps (user name, level name) to Timeline; either may be None
+        self._timelines = {}
+
+    def in_shard(self, user, level_name):
+        '''Whether the attempts of user on a level belong to this shard.'''
+        return self.num_shards == 1 or \
+                shard_of(user, level_name, self.num_shards) == self.shard
+
+    def _restrict_to_shard(self, users):
+        for user in users:
+            user.attempt_index = AttemptIndex(
+                    (level_name, infos)
+                    for level_name, infos in user.attempt_index.items()
+                    if self.in_shard(user, level_name))
+
+    @property
+    def users(self):
+        if self._users is None:
+            if self.index:
+                users = load_indexed_users(self.directory,
+                        None if self.index is True else self.index)
+                if self.num_shards > 1:
+                    self._restrict_to_shard(users)
+            elif self.num_shards > 1:
+                users = index_users(self.directory, self.in_shard)
+            else:
+                users = index_users(self.directory)
+            for user in users:
+                user.read_text = self.read_text
+                if self.compact:
+                    user.attempt_class = CompactAttempt
+            self._users = users
+        return self._users
+
+    def _walk_attempt_infos(self, user_names, level_names):
+        '''Yields (user, level_name, infos) for every level directory of every
+            user, restricted to the given names if they are not None. Uses
+            the users index if it is already loaded, in which case infos are
+            positions in user.attempt_index, otherwise lists only the
+            directories that pass the filters and infos are AttemptInfo.'''
+        if self._users is not None or self.index:
+            for user in self.users:
+                if user_names is not None and \
+                        user_name(user) not in user_names:
+                    continue
+                for level_name in user.attempt_index:
+                    if level_names is None or level_name in level_names:
+                        yield user, level_name, \
+                            range(*user.attempt_index.span(level_name))
+            return
+
+        for user_entry in scandir(os.path.join(self.directory, "users")):
+            if not is_user_name(user_entry.name) or \
+                    (user_names is not None and
+                     user_entry.name not in user_names) or \
+                    not user_entry.is_dir():
+                continue
+            user = User(user_entry.path, read_text=self.read_text)
+            if self.compact:
+                user.attempt_class = CompactAttempt
+            for level_entry in scandir(user_entry.path):
+                if (level_names is None or level_entry.name in level_names) \
+                        and self.in_shard(user_entry.name, level_entry.name) \
+                        and level_entry.is_dir():
+                    yield user, level_entry.name, \
+                        (parse_attempt_filename(entry.name)
+                         for entry in scandir(level_entry.path))
+
+    def iter_attempts(self, levels=None, sectors=None, languages=None,
+                      won=None, min_rating=None, max_rating=None,
+                      since=None, until=None, users=None):
+        '''Lazily yields the attempts matching all of the given filters, in
+            directory order:
+                levels: Level objects or level names
+                sectors: sector numbers
+                languages: language names ("Java", "CSharp")
+                won: True or False
+                min_rating, max_rating: inclusive bounds on rating; attempts
+                    that did not win have no rating and never match
+                since, until: timestamp window [since, until) as datetimes
+                    or seconds since 1970-01-01 UTC
+                users: User objects or user directory names
+            Everything is decided from directory and file names, so attempts
+            are only constructed for matches and no files are opened.'''
+        level_objects = dict((level.level_name, level) for level in self.levels)
+        level_names = set(level_objects)
+        if levels is not None:
+            level_names &= set(getattr(level, 'level_name', level)
+                               for level in levels)
+        if sectors is not None:
+            sectors = set(sectors)
+            level_names = set(name for name in level_names
+                              if level_objects[name].sector_num in sectors)
+        user_names = None
+        if users is not None:
+            user_names = set(user_name(user) for user in users)
+        language_exts = None
+        if languages is not None:
+            language_exts = set(ext for ext, name
+                                in Attempt.language_ext_dict.items()
+                                if name in languages)
+        since = to_epoch(since)
+        until = to_epoch(until)
+
+        for user, level_name, infos in self._walk_attempt_infos(user_names,
+                                                                level_names):
+            level = level_objects[level_name]
+            index = user.attempt_index
+            for info in infos:
+                if info is None:
+                    continue
+                if isinstance(info, AttemptInfo):
+                    epoch, rating, language_ext = \
+                            info.epoch, info.rating, info.language_ext
+                else:
+                    epoch, rating, language_ext = index.epochs[info], \
+                            index.rating(info), index.language_ext(info)
+                if (language_exts is not None and
+                        language_ext not in language_exts) or \
+                        (won is not None and (rating is not None) != won) or \
+                        (since is not None and epoch < since) or \
+                        (until is not None and epoch >= until):
+                    continue
+                if min_rating is not None or max_rating is not None:
+                    if rating is None or \
+                            (min_rating is not None and
+                             rating < min_rating) or \
+                            (max_rating is not None and
+                             rating > max_rating):
+                        continue
+                yield user.attempt_class(user, level, None, info)
+
+    def timeline(self, user=None, level=None):
+        '''Returns the Timeline of the attempts of user (a User or user
+            directory name) on level (a Level or level name). If either is
+            None, the timeline covers all users or all levels. Timelines are
+            built once and kept.'''
+        if user is not None:
+            user = user_name(user)
+        if level is not None:
+            level = getattr(level, 'level_name', level)
+        key = (user, level)
+        timeline = self._timelines.get(key)
+        if timeline is None:
+            timeline = Timeline(self.iter_attempts(
+                    users=None if user is None else [user],
+                    levels=None if level is None else [level]))
+            self._timelines[key] = timeline
+        return timeline
+
+    def load_texts(self, items=None, workers=8, prefetch=None):
+        '''Reads the source texts of many attempts (or the reference
+            solutions of levels) concurrently on a pool of worker threads,
+            storing them in text_cache. Yields (item, text) pairs in the order
+            of items, which defaults to every attempt from iter_attempts().
+            At most prefetch (by default 4 * workers) reads are in flight or
+            waiting to be consumed at once.'''
+        from concurrent.futures import ThreadPoolExecutor
+
+        if items is None:
+            items = self.iter_attempts()
+        if prefetch is None:
+            prefetch = 4 * workers
+
+        def read_text(item):
+            if isinstance(item, Level):
+                return item.challenge_text
+            return item.text
+
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            pending = collections.deque()
+            for item in items:
+                pending.append((item, executor.submit(read_text, item)))
+                if len(pending) >= prefetch:
+                    item, future = pending.popleft()
+                    yield item, future.result()
+            while pending:
+                item, future = pending.popleft()
+                yield item, future.result()
+
+    # Order of the language codes used by to_arrays()
+    language_names = ['CSharp', 'Java']
+    array_columns = ['user', 'sector_num', 'level_in_sector', 'attempt_num',
+                     'timestamp', 'won', 'rating', 'language']
+
+    def to_arrays(self):
+        '''Returns every attempt in the release as a dict of equal-length
+            NumPy arrays, one entry per attempt:
+                user: user number, NNN of "UserNNN" (see user_number())
+                sector_num, level_in_sector: as in Level
+                attempt_num: as in Attempt
+                timestamp: seconds since 1970-01-01 UTC
+                won: bool
+                rating: 1-3, or 0 if the attempt did not win
+                language: index into Data.language_names
+            Built directly from the attempt index, so no Attempt objects are
+            created. Requires NumPy.'''
+        import numpy
+
+        levels = dict((level.level_name, level) for level in self.levels)
+        language_codes = dict((ext, self.language_names.index(name))
+                              for ext, name
+                              in Attempt.language_ext_dict.items())
+
+        # Maps the language codes of AttemptIndex to those of to_arrays()
+        codes = [language_codes[ext] for ext in AttemptIndex.language_exts]
+
+        columns = dict((name, []) for name in self.array_columns)
+        for user in self.users:
+            user_id = user_number(user)
+            index = user.attempt_index
+            for level_name in index:
+                level = levels.get(level_name)
+                if level is None:
+                    continue
+                start, stop = index.span(level_name)
+                count = stop - start
+                ratings = index.ratings[start:stop]
+                columns['user'].extend([user_id] * count)
+                columns['sector_num'].extend([level.sector_num] * count)
+                columns['level_in_sector'].extend(
+                        [level.level_in_sector] * count)
+                columns['attempt_num'].extend(index.attempt_nums[start:stop])
+                columns['timestamp'].extend(index.epochs[start:stop])
+                columns['won'].extend(rating != 0 for rating in ratings)
+                columns['rating'].extend(ratings)
+                columns['language'].extend(
+                        codes[code]
+                        for code in index.language_codes[start:stop])
+
+        dtypes = {
+                'user': numpy.int32,
+                'sector_num': numpy.int8,
+                'level_in_sector': numpy.int8,
+                'attempt_num': numpy.int16,
+                'timestamp': numpy.int64,
+                'won': numpy.bool_,
+                'rating': numpy.int8,
+                'language': numpy.int8,
+                }
+        return dict((name, numpy.array(values, dtype=dtypes[name]))
+                    for name, values in columns.items())
+
+    def to_dataframe(self):
+        '''Like to_arrays(), but as a pandas DataFrame with user and language
+            as categorical columns of user directory names and language
+            names. Requires pandas.'''
+        import numpy
+        import pandas
+
+        arrays = self.to_arrays()
+        frame = pandas.DataFrame(arrays, columns=self.array_columns)
+        # In order of user number, so the codes are found by binary search
+        user_names = sorted((user_name(user) for user in self.users),
+                            key=user_number)
+        numbers = numpy.array([user_number(name) for name in user_names],
+                              dtype=arrays['user'].dtype)
+        frame['user'] = pandas.Categorical.from_codes(
+                numpy.searchsorted(numbers, arrays['user']), user_names)
+        frame['language'] = pandas.Categorical.from_codes(
+                arrays['language'], self.language_names)
+        return frame
@@ -0,0 +1,218 @@
+'''Opt-in counters and latency histograms for codehunt.datarelease and
+    codehunt.rest. Nothing is recorded until the registry is enabled:
+
+        codehunt.metrics.registry.enable()
+        ...
+        print(codehunt.metrics.registry.snapshot().to_prometheus())
+
+    or, to see what one region of code did:
+
+        with codehunt.metrics.registry.capture() as snapshot:
+            ...
+        print(snapshot.as_dict())
+
+    Metrics recorded:
+        codehunt_stat_total                 stat calls (os.stat, exists)
+        codehunt_listdir_total              directory listings
+        codehunt_open_total                 files opened for reading
+        codehunt_read_chars_total           characters of text read
+        codehunt_pack_read_total            texts read from a text pack
+        codehunt_text_cache_total{result}   text_cache hits/misses/evictions
+        codehunt_memo_total{function,result}
+                                            memoized function hits/misses
+        codehunt_http_requests_total{endpoint,status}
+        codehunt_http_request_seconds{endpoint}
+                                            histogram of request latency
+        codehunt_exploration_polls_total    polls of incomplete explorations
+        codehunt_exploration_diagnostics_total{kind}
+                                            unusual test cases decoded:
+                                            name_with_space (a parameter
+                                            name containing a space) or
+                                            no_values (no parameter values)
+        codehunt_result_cache_total{result} ResultCache hits/misses
+        codehunt_http_throttled_total{endpoint}
+                                            responses with status 429 or 503
+        codehunt_rate_limit_wait_seconds_total
+                                            time requests waited to be sent
+'''
+
+import contextlib
+import threading
+
+
+# Upper bounds (in seconds) of the latency histogram buckets
+default_buckets = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0,
+                   10.0, float('inf'))
+
+def _series(name, labels):
+    if not labels:
+        return name
+    return '%s{%s}' % (name, ','.join('%s="%s"' % label for label in labels))
+
+def _format_bound(bound):
+    return '+Inf' if bound == float('inf') else repr(bound)
+
+class Snapshot(object):
+    '''The values of all metrics at one point in time, or the change in them
+        over a capture() block.'''
+
+    def __init__(self, counters, histograms, buckets=default_buckets):
+        # Maps (name, labels) to value
+        self.counters = counters
+        # Maps (name, labels) to [per-bucket counts, sum, count]
+        self.histograms = histograms
+        self.buckets = buckets
+
+    def __repr__(self):
+        return "%s.%s(%s)" % (type(self).__module__, type(self).__name__,
+                              repr(self.as_dict()))
+
+    def __sub__(self, other):
+        counters = {}
+        for key, value in self.counters.items():
+            difference = value - other.counters.get(key, 0)
+            if difference:
+                counters[key] = difference
+        histograms = {}
+        for key, (counts, total, count) in self.histograms.items():
+            old_counts, old_total, old_count = other.histograms.get(
+                    key, ([0] * len(counts), 0.0, 0))
+            if count != old_count:
+                histograms[key] = ([new - old for new, old
+                                    in zip(counts, old_counts)],
+                                   total - old_total, count - old_count)
+        return Snapshot(counters, histograms, self.buckets)
+
+    def as_dict(self):
+        '''Returns {'counters': {series: value},
+                    'histograms': {series: {'buckets': {bound: count},
+                                            'sum': seconds,
+                                            'count': count}}}
+            where series is e.g. 'codehunt_http_requests_total{endpoint="token"}'
+            and bucket counts are cumulative.'''
+        histograms = {}
+        for (name, labels), (counts, total, count) in self.histograms.items():
+            cumulative = 0
+            buckets = {}
+            for bound, bucket_count in zip(self.buckets, counts):
+                cumulative += bucket_count
+                buckets[_format_bound(bound)] = cumulative
+            histograms[_series(name, labels)] = {
+                    'buckets': buckets,
+                    'sum': total,
+                    'count': count,
+                    }
+        return {
+                'counters': dict((_series(name, labels), value)
+                                 for (name, labels), value
+                                 in self.counters.items()),
+                'histograms': histograms,
+                }
+
+    def to_prometheus(self):
+        '''Returns the snapshot in the Prometheus text exposition format.'''
+        lines = []
+        typed = set()
+        for (name, labels), value in sorted(self.counters.items()):
+            if name not in typed:
+                lines.append('# TYPE %s counter' % name)
+                typed.add(name)
+            lines.append('%s %s' % (_series(name, labels), value))
+        for (name, labels), (counts, total, count) in \
+                sorted(self.histograms.items()):
+            if name not in typed:
+                lines.append('# TYPE %s histogram' % name)
+                typed.add(name)
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets, counts):
+                cumulative += bucket_count
+                lines.append('%s %d' % (
+                        _series(name + '_bucket',
+                                labels + (('le', _format_bound(bound)),)),
+                        cumulative))
+            lines.append('%s %r' % (_series(name + '_sum', labels), total))
+            lines.append('%s %d' % (_series(name + '_count', labels), count))
+        return '\n'.join(lines) + '\n'
+
+class Registry(object):
+    '''Thread-safe store of counters and histograms. Recording is a no-op
+        while the registry is disabled (the default).'''
+
+    def __init__(self, buckets=default_buckets):
+        self.enabled = False
+        self.buckets = buckets
+        self._counters = {}
+        self._histograms = {}
+        self._collectors = []
+        self._lock = threading.Lock()
+
+    def enable(self):
+        self.enabled = True
+
+    def disable(self):
+        self.enabled = False
+
+    def reset(self):
+        with self._lock:
+            self._counters.clear()
+            self._histograms.clear()
+
+    def increment(self, name, amount=1, **labels):
+        if not self.enabled:
+            return
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0) + amount
+
+    def observe(self, name, value, **labels):
+        '''Records value (in seconds) in the histogram name.'''
+        if not self.enabled:
+            return
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            histogram = self._histograms.get(key)
+            if histogram is None:
+                histogram = self._histograms[key] = \
+                        [[0] * len(self.buckets), 0.0, 0]
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    histogram[0][i] += 1
+                    break
+            histogram[1] += value
+            histogram[2] += 1
+
+    def add_collector(self, collector):
+        '''Registers a function called at every snapshot to report counters
+            kept elsewhere. It returns a dict mapping (name, labels) keys,
+            with labels a sorted tuple of (label, value) pairs, to values.'''
+        self._collectors.append(collector)
+
+    def snapshot(self):
+        with self._lock:
+            counters = dict(self._counters)
+            histograms = dict((key, (list(counts), total, count))
+                              for key, (counts, total, count)
+                              in self._histograms.items())
+        if self.enabled:
+            for collector in self._collectors:
+                counters.update(collector())
+        return Snapshot(counters, histograms, self.buckets)
+
+    @contextlib.contextmanager
+    def capture(self):
+        '''Enables the registry for the duration of the block and yields a
+            Snapshot that, once the block exits, holds what changed during
+            it. Activity in other threads during the block is included.'''
+        was_enabled = self.enabled
+        self.enabled = True
+        before = self.snapshot()
+        result = Snapshot({}, {}, self.buckets)
+        try:
+            yield result
+        finally:
+            difference = self.snapshot() - before
+            result.counters = difference.counters
+            result.histograms = difference.histograms
+            self.enabled = was_enabled
+
+registry = Registry()
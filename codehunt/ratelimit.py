@@ -0,0 +1,246 @@
+'''Client-side rate limiting for codehunt.rest.Client.
+
+    A TokenBucket caps the request rate. An AdaptiveLimiter caps the number
+    of requests in flight and adjusts that cap AIMD-style: when the server
+    throttles a request (429 Too Many Requests or 503 Service Unavailable)
+    the cap is multiplied by decrease_factor, and every request that
+    completes with healthy latency raises it by 1/cap, i.e. by about one
+    per round trip. A Retry-After header on a throttled response stops all
+    requests until the time it gives.
+
+        limiter = AdaptiveLimiter(max_concurrency=16, rate=20)
+        client = codehunt.rest.Client(id, secret, limiter=limiter)
+        ...
+        print(limiter.stats())
+'''
+
+import calendar
+import collections
+import threading
+import time
+
+from codehunt import metrics
+
+
+# Statuses with which a server asks clients to slow down
+throttle_statuses = (429, 503)
+
+# Clock for measuring intervals; not affected by changes to the system time
+_clock = time.monotonic if hasattr(time, 'monotonic') else time.time
+
+def parse_retry_after(value, now=None):
+    '''Seconds to wait according to a Retry-After header, which is either
+        a number of seconds or an HTTP date. Returns None if value is
+        missing or invalid.'''
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        from email.utils import parsedate_tz
+    except ImportError:
+        # Python 2.x
+        from email.Utils import parsedate_tz
+    date = parsedate_tz(value)
+    if date is None:
+        return None
+    offset = date[9] or 0
+    when = calendar.timegm(date[:6] + (0, 0, 0)) - offset
+    return max(0.0, when - (time.time() if now is None else now))
+
+class TokenBucket(object):
+    '''Allows rate requests per second on average, and bursts of up to burst
+        requests (by default one second's worth). Safe to share between
+        threads; waiting threads are served in the order they arrived.'''
+
+    def __init__(self, rate, burst=None):
+        if rate <= 0:
+            raise ValueError("rate must be positive")
+        self.rate = float(rate)
+        self.burst = float(burst if burst is not None else max(rate, 1))
+        self._tokens = self.burst
+        self._updated = _clock()
+        self._lock = threading.Lock()
+
+    def __repr__(self):
+        return "%s.%s(%r, %r)" % (type(self).__module__, type(self).__name__,
+                                  self.rate, self.burst)
+
+    def _refill(self, now):
+        self._tokens = min(self.burst,
+                           self._tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    def set_rate(self, rate):
+        with self._lock:
+            self._refill(_clock())
+            self.rate = float(rate)
+
+    def acquire(self):
+        '''Takes a token, sleeping until one is available. Returns the number
+            of seconds slept.'''
+        with self._lock:
+            self._refill(_clock())
+            # Reserve the token now, going into debt if needed, so that
+            #   later callers queue up behind this one.
+            self._tokens -= 1
+            wait = -self._tokens / self.rate if self._tokens < 0 else 0.0
+        if wait > 0:
+            time.sleep(wait)
+        return wait
+
+class AdaptiveLimiter(object):
+    '''Limits the requests of a Client (see the module documentation).
+
+        max_concurrency, min_concurrency: bounds of the concurrency cap,
+            which starts at initial_concurrency (default max_concurrency)
+        rate, burst: if rate is given, requests also go through a
+            TokenBucket(rate, burst)
+        decrease_factor: multiplies the cap when a request is throttled;
+            at most once per round trip
+        latency_tolerance: the cap only grows while the latency of each
+            endpoint stays below latency_tolerance times the lowest latency
+            seen for it
+        window: seconds over which stats() measures the request rate
+    '''
+
+    def __init__(self, max_concurrency=10, min_concurrency=1,
+                 initial_concurrency=None, rate=None, burst=None,
+                 decrease_factor=0.5, latency_tolerance=2.0, window=10.0):
+        if not 1 <= min_concurrency <= max_concurrency:
+            raise ValueError("need 1 <= min_concurrency <= max_concurrency")
+        self.max_concurrency = max_concurrency
+        self.min_concurrency = min_concurrency
+        if initial_concurrency is None:
+            initial_concurrency = max_concurrency
+        self.concurrency = float(initial_concurrency)
+        self.bucket = TokenBucket(rate, burst) if rate else None
+        self.decrease_factor = decrease_factor
+        self.latency_tolerance = latency_tolerance
+        self.window = window
+
+        self.requests = 0
+        self.throttled = 0
+        self.decreases = 0
+        self.wait_seconds = 0.0
+
+        self._in_flight = 0
+        self._paused_until = 0.0
+        self._last_decrease = 0.0
+        # Maps endpoint to lowest latency seen
+        self._min_latency = {}
+        # Send times of recent requests, for measuring the rate
+        self._recent = collections.deque()
+        self._condition = threading.Condition()
+
+    def __repr__(self):
+        return "%s.%s(%r)" % (type(self).__module__, type(self).__name__,
+                              self.max_concurrency)
+
+    @property
+    def rate(self):
+        '''Configured maximum rate in requests per second, or None.'''
+        return self.bucket.rate if self.bucket is not None else None
+
+    def set_rate(self, rate):
+        '''Changes the maximum rate; None removes the limit.'''
+        if rate is None:
+            self.bucket = None
+        elif self.bucket is None:
+            self.bucket = TokenBucket(rate)
+        else:
+            self.bucket.set_rate(rate)
+
+    def acquire(self):
+        '''Blocks until another request may be sent. Returns the send time
+            to pass to release() once the response has arrived.'''
+        start = _clock()
+        with self._condition:
+            while True:
+                now = _clock()
+                if now < self._paused_until:
+                    self._condition.wait(self._paused_until - now)
+                elif self._in_flight >= int(self.concurrency):
+                    self._condition.wait()
+                else:
+                    break
+            self._in_flight += 1
+        if self.bucket is not None:
+            self.bucket.acquire()
+
+        sent = _clock()
+        waited = sent - start
+        with self._condition:
+            self.requests += 1
+            self.wait_seconds += waited
+            self._recent.append(sent)
+            self._forget_before(sent - self.window)
+        metrics.registry.increment('codehunt_rate_limit_wait_seconds_total',
+                                   waited)
+        return sent
+
+    def _forget_before(self, cutoff):
+        while self._recent and self._recent[0] < cutoff:
+            self._recent.popleft()
+
+    def release(self, sent, endpoint=None, status=None, retry_after=None):
+        '''Records the outcome of a request sent at sent (from acquire()).
+            status is the HTTP status, or None if the request failed without
+            a response; retry_after is in seconds.'''
+        now = _clock()
+        with self._condition:
+            self._in_flight -= 1
+            if status in throttle_statuses:
+                self.throttled += 1
+                # Requests sent before the last decrease were in flight at
+                #   the old cap; don't cut it again for them.
+                if sent >= self._last_decrease:
+                    self.concurrency = max(
+                            float(self.min_concurrency),
+                            self.concurrency * self.decrease_factor)
+                    self._last_decrease = now
+                    self.decreases += 1
+                if retry_after:
+                    self._paused_until = max(self._paused_until,
+                                             now + retry_after)
+            elif status is not None and status < 500:
+                latency = now - sent
+                lowest = self._min_latency.get(endpoint)
+                if lowest is None or latency < lowest:
+                    lowest = self._min_latency[endpoint] = latency
+                if latency <= self.latency_tolerance * lowest:
+                    self.concurrency = min(
+                            float(self.max_concurrency),
+                            self.concurrency + 1.0 / self.concurrency)
+            self._condition.notify_all()
+        if status in throttle_statuses:
+            metrics.registry.increment('codehunt_http_throttled_total',
+                                       endpoint=endpoint)
+
+    def stats(self):
+        '''Returns a dict describing the limiter's current state:
+                concurrency: current cap on requests in flight
+                in_flight: requests in flight now
+                rate_limit: configured maximum rate, or None
+                request_rate: requests per second sent over the last window
+                requests, throttled: totals since the limiter was created
+                decreases: how often the cap was cut
+                wait_seconds: total time requests waited to be sent
+                paused_for: seconds left of a Retry-After pause
+        '''
+        now = _clock()
+        with self._condition:
+            self._forget_before(now - self.window)
+            return {
+                    'concurrency': int(self.concurrency),
+                    'in_flight': self._in_flight,
+                    'rate_limit': self.rate,
+                    'request_rate': len(self._recent) / self.window,
+                    'requests': self.requests,
+                    'throttled': self.throttled,
+                    'decreases': self.decreases,
+                    'wait_seconds': self.wait_seconds,
+                    'paused_for': max(0.0, self._paused_until - now),
+                    }
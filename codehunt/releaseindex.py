@@ -0,0 +1,162 @@
+import os
+import sqlite3
+
+from codehunt import metrics
+from codehunt.datarelease import AttemptInfo, is_user_name, \
+        parse_attempt_filename, scandir
+
+
+default_index_filename = "codehunt-index.sqlite"
+
+schema = '''
+CREATE TABLE IF NOT EXISTS meta (
+    key TEXT PRIMARY KEY,
+    value TEXT
+);
+CREATE TABLE IF NOT EXISTS directories (
+    user TEXT NOT NULL,
+    level TEXT NOT NULL, -- '' for the user directory itself
+    mtime REAL NOT NULL,
+    PRIMARY KEY (user, level)
+);
+CREATE TABLE IF NOT EXISTS attempts (
+    user TEXT NOT NULL,
+    level TEXT NOT NULL,
+    name TEXT NOT NULL,
+    attempt_num INTEGER NOT NULL,
+    timestamp INTEGER NOT NULL, -- seconds since 1970-01-01 UTC
+    won INTEGER NOT NULL,
+    rating INTEGER,
+    language TEXT NOT NULL -- "java" or "cs"
+);
+CREATE INDEX IF NOT EXISTS attempts_by_user ON attempts (user);
+'''
+
+class ReleaseIndex(object):
+    '''Persistent index of the parsed attempt filenames of a data release.
+
+        The index lives in a single SQLite file (by default next to the
+        "users" and "solutions" directories of the release) and records
+        every attempt along with the mtime of every user and level directory.
+        Loading it rescans only the user directories whose mtimes changed
+        since it was written.'''
+
+    version = '1'
+
+    def __init__(self, directory, filename=None):
+        self.directory = directory
+        self.users_directory = os.path.join(directory, "users")
+        if filename is None:
+            filename = os.path.join(directory, default_index_filename)
+        self.filename = filename
+
+        self.connection = sqlite3.connect(filename)
+        self.connection.executescript(schema)
+        row = self.connection.execute(
+                "SELECT value FROM meta WHERE key = 'version'").fetchone()
+        if row is None or row[0] != self.version:
+            self._reset()
+
+    def __repr__(self):
+        return "%s.%s(%s, %s)" % (type(self).__module__, type(self).__name__,
+                                  repr(self.directory), repr(self.filename))
+
+    def close(self):
+        self.connection.close()
+
+    def _reset(self):
+        with self.connection:
+            self.connection.execute("DELETE FROM directories")
+            self.connection.execute("DELETE FROM attempts")
+            self.connection.execute(
+                    "INSERT OR REPLACE INTO meta VALUES ('version', ?)",
+                    (self.version,))
+
+    def _stored_mtimes(self):
+        mtimes = {}
+        for user, level, mtime in self.connection.execute(
+                "SELECT user, level, mtime FROM directories"):
+            mtimes.setdefault(user, {})[level] = mtime
+        return mtimes
+
+    def _stored_attempts(self, mtimes):
+        users = dict((user, dict((level, []) for level in levels if level))
+                     for user, levels in mtimes.items())
+        for row in self.connection.execute(
+                "SELECT user, level, name, attempt_num, timestamp, rating,"
+                " language FROM attempts ORDER BY rowid"):
+            users[row[0]][row[1]].append(AttemptInfo(*row[2:]))
+        return users
+
+    def _is_stale(self, user_path, mtimes):
+        '''True if the user directory or any of its known level directories
+            changed since mtimes were recorded.'''
+        try:
+            for level, mtime in mtimes.items():
+                metrics.registry.increment('codehunt_stat_total')
+                if os.stat(os.path.join(user_path, level)).st_mtime != mtime:
+                    return True
+        except OSError:
+            return True
+        return False
+
+    def _scan_user(self, user_path):
+        '''Rescans one user directory. Returns (attempts, mtimes) in the same
+            shape as stored in the index.'''
+        attempts = {}
+        metrics.registry.increment('codehunt_stat_total')
+        mtimes = {'': os.stat(user_path).st_mtime}
+        for level_entry in scandir(user_path):
+            if level_entry.is_dir():
+                metrics.registry.increment('codehunt_stat_total')
+                mtimes[level_entry.name] = level_entry.stat().st_mtime
+                infos = []
+                for entry in scandir(level_entry.path):
+                    info = parse_attempt_filename(entry.name)
+                    if info is not None:
+                        infos.append(info)
+                attempts[level_entry.name] = infos
+        return attempts, mtimes
+
+    def load(self):
+        '''Returns a dict mapping user directory names to dicts mapping level
+            names to lists of AttemptInfo, bringing the index up to date with
+            the release on disk first.'''
+        stored_mtimes = self._stored_mtimes()
+        users = self._stored_attempts(stored_mtimes)
+
+        present = set()
+        changed = {}
+        for entry in scandir(self.users_directory):
+            if not (is_user_name(entry.name) and entry.is_dir()):
+                continue
+            present.add(entry.name)
+            mtimes = stored_mtimes.get(entry.name)
+            if mtimes is None or self._is_stale(entry.path, mtimes):
+                changed[entry.name] = self._scan_user(entry.path)
+        removed = set(stored_mtimes) - present
+
+        if changed or removed:
+            with self.connection:
+                for user in removed | set(changed):
+                    self.connection.execute(
+                            "DELETE FROM directories WHERE user = ?", (user,))
+                    self.connection.execute(
+                            "DELETE FROM attempts WHERE user = ?", (user,))
+                    users.pop(user, None)
+                for user, (attempts, mtimes) in changed.items():
+                    self.connection.executemany(
+                            "INSERT INTO directories VALUES (?, ?, ?)",
+                            [(user, level, mtime)
+                             for level, mtime in mtimes.items()])
+                    self.connection.executemany(
+                            "INSERT INTO attempts VALUES"
+                            " (?, ?, ?, ?, ?, ?, ?, ?)",
+                            [(user, level, info.name, info.attempt_num,
+                              info.epoch, info.rating is not None,
+                              info.rating, info.language_ext)
+                             for level, infos in attempts.items()
+                             for info in infos])
+                    users[user] = attempts
+
+        return users
@@ -1,7 +1,24 @@
 import json
-import requests
+import logging
+import threading
 import time
 
+from codehunt import metrics
+from codehunt.ratelimit import AdaptiveLimiter, _clock, parse_retry_after, \
+        throttle_statuses
+from codehunt.resultcache import result_key
+
+# Use a faster JSON decoder if one is installed.
+try:
+    from orjson import loads as json_loads
+except ImportError:
+    try:
+        from ujson import loads as json_loads
+    except ImportError:
+        json_loads = json.loads
+
+logger = logging.getLogger(__name__)
+
 
 class ExplorationTestCase(object):
     '''Wrapper for the test case part of an Exploration.'''
@@ -19,40 +36,39 @@ class ExplorationTestCase(object):
         self.exception = self.test_case['exception']
         self.stack_trace = self.test_case['stackTrace']
 
-        if names and test_case['values']:
-            self.values_dict = dict(zip(names, test_case['values']))
-
-            self.names = list(names) # copy names because we mutate it
-            self.values = test_case['values']
-
-            if 'EXPECTED RESULT' in self.values_dict:
-                self.expected = self.values_dict['EXPECTED RESULT']
-                del self.values_dict['EXPECTED RESULT']
-                idx = self.names.index('EXPECTED RESULT')
-                del self.names[idx]
-                del self.values[idx]
-            else:
-                self.expected = None
-
-            if 'YOUR RESULT' in self.values_dict:
-                self.actual = self.values_dict['YOUR RESULT']
-                del self.values_dict['YOUR RESULT']
-                idx = self.names.index('YOUR RESULT')
-                del self.names[idx]
-                del self.values[idx]
-            else:
-                self.actual = None
-
-            for name in self.names:
-                if ' ' in name:
-                    print(name)
+        values = test_case['values']
+        if names and values:
+            # Split the special result columns off the parameters without
+            #   modifying the lists we were given.
+            self.names = []
+            self.values = []
+            self.expected = None
+            self.actual = None
+            for name, value in zip(names, values):
+                if name == 'EXPECTED RESULT':
+                    self.expected = value
+                elif name == 'YOUR RESULT':
+                    self.actual = value
+                else:
+                    self.names.append(name)
+                    self.values.append(value)
+                    if ' ' in name:
+                        metrics.registry.increment(
+                                'codehunt_exploration_diagnostics_total',
+                                kind='name_with_space')
+                        logger.debug("Parameter name with space: %s", name)
+            self.values_dict = dict(zip(self.names, self.values))
         else:
             self.names = None
             self.values = None
+            self.values_dict = None
             self.actual = None
             self.expected = None
 
-            print(self.test_case)
+            metrics.registry.increment(
+                    'codehunt_exploration_diagnostics_total',
+                    kind='no_values')
+            logger.debug("Test case without values: %s", self.test_case)
 
     def __repr__(self):
         return "%s.%s(%s, %s)" % (type(self).__module__, type(self).__name__,
@@ -105,14 +121,14 @@ class Exploration(object):
 
         self.attempt_compiles = self.kind == 'TestCases'
 
+        # Decoded on first access to test_cases
+        self._test_cases = None
+
         if self.attempt_compiles:
             self.has_won = exp['hasWon']
-            self.test_cases = [ExplorationTestCase(exp['names'], tc)
-                               for tc in exp['testCases']]
             self.errors = None
         else:
             self.has_won = False
-            self.test_cases = None
 
             if self.kind == 'InternalError':
                 # Should not happen
@@ -132,6 +148,16 @@ class Exploration(object):
         return "%s.%s(%s, %s)" % (type(self).__module__, type(self).__name__,
                                   repr(self.attempt), repr(self.exp))
 
+    @property
+    def test_cases(self):
+        '''List of ExplorationTestCase, or None if the attempt does not
+            compile.'''
+        if self._test_cases is None and self.attempt_compiles:
+            names = self.exp['names']
+            self._test_cases = [ExplorationTestCase(names, tc)
+                                for tc in self.exp['testCases']]
+        return self._test_cases
+
     def __str__(self):
         if self.kind == 'TestCases':
             return "{Exploration %(kind)s%(won)s [%(test_cases)s]}" % {
@@ -179,30 +205,272 @@ class Translation(object):
                     (self.attempt, [compilation_error_to_string(error)
                                     for error in self.errors])
 
+def map_concurrently(function, items, concurrency):
+    '''Calls function on each of items on up to concurrency threads. Yields
+        (item, future) pairs in the order the calls complete; future.result()
+        returns the result or raises the exception of the call.'''
+    from concurrent.futures import (FIRST_COMPLETED, ThreadPoolExecutor,
+                                    wait as wait_for_futures)
+
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        in_flight = {}
+        for item in items:
+            in_flight[executor.submit(function, item)] = item
+            if len(in_flight) >= concurrency:
+                done, _ = wait_for_futures(in_flight,
+                                           return_when=FIRST_COMPLETED)
+                for future in done:
+                    yield in_flight.pop(future), future
+        while in_flight:
+            done, _ = wait_for_futures(in_flight, return_when=FIRST_COMPLETED)
+            for future in done:
+                yield in_flight.pop(future), future
+
+class _PendingResult(object):
+    '''A result that one thread is computing and others are waiting for.'''
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.data = None
+
 class Client(object):
     '''Client for Code Hunt REST API. See https://api.codehunt.com/ for
         documentation on the API.'''
 
     base_url = 'https://api.codehunt.com/api'
 
-    def __init__(self, client_id, client_secret):
+    # Bounds on the delay between polls of an incomplete exploration
+    poll_initial_delay = 0.1
+    poll_max_delay = 5.0
+    # Seconds before a token's stated expiry at which it is replaced (at most
+    #   half the token's lifetime)
+    token_refresh_margin = 60
+
+    def __init__(self, client_id, client_secret, pool_size=10, retries=3,
+                 backoff=0.5, timeout=None, base_url=None, cache=None,
+                 rate_limit=None, limiter=None):
         '''client_id and client_secret are the Code Hunt REST API equivalent
             of a username and password. If you do not have a client_id and
-            client_secret, you can request them from codehunt@microsoft.com.'''
-
+            client_secret, you can request them from codehunt@microsoft.com.
+
+            Requests share a pool of up to pool_size keep-alive connections.
+            Connection errors and 5xx responses are retried up to retries
+            times, sleeping backoff * 2**n seconds between tries; error
+            responses that remain raise requests.HTTPError and are never
+            cached. timeout is passed on to every request.
+
+            base_url overrides the API location, e.g. to point the client
+            at a codehunt.stubserver.StubServer.
+
+            cache, if given, is a codehunt.resultcache.ResultCache. Results
+            of explorations and translations are then looked up there before
+            making any request, and identical requests made concurrently
+            from several threads are only sent once.
+
+            All requests go through limiter, a
+            codehunt.ratelimit.AdaptiveLimiter, which by default allows up
+            to pool_size requests in flight and at most rate_limit requests
+            per second (if given). It lowers the number in flight when the
+            server answers 429 or 503 and raises it again while responses
+            are fast. Throttled requests are retried up to retries times,
+            waiting as long as the Retry-After header says or backoff *
+            2**n seconds.'''
+
+        if base_url is not None:
+            self.base_url = base_url
         self.client_id = client_id
         self.client_secret = client_secret
-
-        self.headers = self._get_auth_header()
+        self.timeout = timeout
+        self.cache = cache
+        self.retries = retries
+        self.backoff = backoff
+        if limiter is None:
+            limiter = AdaptiveLimiter(max_concurrency=pool_size,
+                                      rate=rate_limit)
+        self.limiter = limiter
+        # Maps result keys being computed to _PendingResult objects
+        self._pending = {}
+        self._pending_lock = threading.Lock()
+
+        self.session = self._make_session(pool_size, retries, backoff)
+        # Maps endpoint name to [number of requests, total seconds]
+        self.timings = {}
+        self._timings_lock = threading.Lock()
+
+        self._auth_header = None
+        self._auth_expires = None
+        self._auth_lock = threading.Lock()
+        self._refresh_auth_header(None)
+
+    def _make_session(self, pool_size, retries, backoff):
+        # Imported here so that importing this module stays cheap.
+        import requests
+        from requests.adapters import HTTPAdapter
+        from urllib3.util.retry import Retry
+
+        retry_args = {
+                'total': retries,
+                'backoff_factor': backoff,
+                # 429 and 503 are handled by _request() and the limiter.
+                'status_forcelist': (500, 502, 504),
+                'respect_retry_after_header': False,
+                'raise_on_status': False,
+                }
+        try:
+            # Retry POSTs too: re-sending an exploration is harmless.
+            retry = Retry(allowed_methods=None, **retry_args)
+        except TypeError:
+            # urllib3 < 1.26
+            retry = Retry(method_whitelist=False, **retry_args)
+        adapter = HTTPAdapter(pool_connections=pool_size,
+                              pool_maxsize=pool_size,
+                              max_retries=retry)
+
+        session = requests.Session()
+        session.mount('http://', adapter)
+        session.mount('https://', adapter)
+        return session
+
+    def close(self):
+        self.session.close()
+
+    def _request(self, method, endpoint, url, authenticate=True, **kwargs):
+        '''Sends a request through the session. Unless authenticate is False,
+            the request carries the current bearer token, and if the server
+            rejects it with 401 the token is refreshed and the request is
+            sent once more. Throttled requests are retried after a delay;
+            if the server is still throttling after self.retries retries,
+            raises requests.HTTPError.'''
+        kwargs.setdefault('timeout', self.timeout)
+        refreshed = False
+        throttled = 0
+        while True:
+            if authenticate:
+                kwargs['headers'] = headers = self.headers
+            resp = self._send(method, endpoint, url, **kwargs)
+            if resp.status_code == 401 and authenticate and not refreshed:
+                self._refresh_auth_header(headers)
+                refreshed = True
+            elif resp.status_code in throttle_statuses and \
+                    throttled < self.retries:
+                # A Retry-After delay is enforced by the limiter, for every
+                #   thread; otherwise back off in this one.
+                if parse_retry_after(resp.headers.get('Retry-After')) is None:
+                    time.sleep(self.backoff * 2 ** throttled)
+                throttled += 1
+            elif resp.status_code in throttle_statuses:
+                import requests
+
+                raise requests.HTTPError(
+                        "%s %s still throttled (HTTP %d) after %d retries" %
+                        (method, url, resp.status_code, throttled),
+                        response=resp)
+            else:
+                return resp
+
+    def _send(self, method, endpoint, url, **kwargs):
+        '''Sends a request through the session once the limiter allows it,
+            recording its duration under endpoint in self.timings and in
+            codehunt.metrics.'''
+        sent = self.limiter.acquire()
+        start = time.time()
+        status = 'error'
+        resp = None
+        try:
+            resp = self.session.request(method, url, **kwargs)
+            status = str(resp.status_code)
+            return resp
+        finally:
+            if resp is None:
+                self.limiter.release(sent, endpoint)
+            else:
+                self.limiter.release(sent, endpoint, resp.status_code,
+                        parse_retry_after(resp.headers.get('Retry-After')))
+            elapsed = time.time() - start
+            with self._timings_lock:
+                timing = self.timings.setdefault(endpoint, [0, 0.0])
+                timing[0] += 1
+                timing[1] += elapsed
+            metrics.registry.increment('codehunt_http_requests_total',
+                                       endpoint=endpoint, status=status)
+            metrics.registry.observe('codehunt_http_request_seconds',
+                                     elapsed, endpoint=endpoint)
+
+    def _cached(self, key, compute, cacheable):
+        '''Returns the JSON result for key from the cache, or by calling
+            compute() and storing the result if cacheable(result). While one
+            thread is computing a key, other threads asking for it wait for
+            that result instead of sending their own request.'''
+        if self.cache is None:
+            return compute()
+        data = self.cache.get(key)
+        if data is not None:
+            return data
+
+        with self._pending_lock:
+            pending = self._pending.get(key)
+            owner = pending is None
+            if owner:
+                pending = self._pending[key] = _PendingResult()
+        if not owner:
+            pending.done.wait()
+            if pending.data is None:
+                # The request failed in the other thread; try again here.
+                return compute()
+            return pending.data
+
+        try:
+            data = compute()
+            pending.data = data
+            if cacheable(data):
+                self.cache.put(key, data)
+            return data
+        finally:
+            with self._pending_lock:
+                del self._pending[key]
+            pending.done.set()
+
+    @property
+    def headers(self):
+        '''Authorization headers with a token that has not expired.'''
+        if self._auth_expires is not None and \
+                _clock() >= self._auth_expires:
+            return self._refresh_auth_header(self._auth_header)
+        return self._auth_header
+
+    def _refresh_auth_header(self, stale_header):
+        '''Replaces stale_header with a new token. Only one thread fetches a
+            token at a time; threads that were all holding the same stale
+            header share the single new token.'''
+        with self._auth_lock:
+            if self._auth_header is not stale_header:
+                # Another thread already replaced it.
+                return self._auth_header
+            self._auth_header, self._auth_expires = self._get_auth_header()
+            return self._auth_header
 
     def _get_auth_header(self):
-        resp = requests.post("%s/token" % self.base_url,
+        '''Requests a new token. Returns the headers to authenticate with and
+            the time, on ratelimit._clock, at which to replace them (None if
+            the server did not say when the token expires).'''
+        resp = self._request('POST', 'token', "%s/token" % self.base_url,
+                authenticate = False,
                 params = { 'grant_type': 'client_credentials',
                            'client_id': self.client_id,
                            'client_secret': self.client_secret })
-        token = resp.json()['access_token']
+        resp.raise_for_status()
+        data = json_loads(resp.content)
+        token = data['access_token']
 
-        return { 'Authorization': 'Bearer %s' % token }
+        expires = None
+        if data.get('expires_in') is not None:
+            expires_in = float(data['expires_in'])
+            # Short-lived tokens would be stale on arrival with the full
+            #   margin; use at most half their lifetime.
+            expires = _clock() + expires_in - \
+                    min(self.token_refresh_margin, expires_in / 2)
+
+        return { 'Authorization': 'Bearer %s' % token }, expires
 
     def explore(self, attempt, wait=False):
         '''Perform an exploration on an attempt finding one of three cases:
@@ -212,8 +480,28 @@ class Client(object):
             
         Returns a value of type Exploration.'''
 
-        resp = requests.post("%s/explorations" % self.base_url,
-                             headers = self.headers,
+        def compute():
+            get_exp_url = self._start_exploration(attempt)
+            data = self._get_exploration(get_exp_url)
+            # Don't wait for computation because any explorations in the
+            #   data release should be cached and be available immediately.
+            if wait:
+                data = self._wait_for_exploration(get_exp_url, data)
+            return data
+
+        key = None
+        if self.cache is not None:
+            key = result_key('explore', attempt.language, attempt.text,
+                             attempt.level.challenge_id)
+        data = self._cached(key, compute,
+                            lambda data: data.get('isComplete') is True)
+
+        return Exploration(attempt, data)
+
+    def _start_exploration(self, attempt):
+        '''POSTs an exploration request and returns the URL to GET it from.'''
+        resp = self._request('POST', 'explorations',
+                             "%s/explorations" % self.base_url,
                 data = json.dumps({
                         'program': {
                                 'language': attempt.language,
@@ -221,18 +509,54 @@ class Client(object):
                             },
                         'challengeId': attempt.level.challenge_id,
                     }))
-        data = resp.json()
+        resp.raise_for_status()
+        data = json_loads(resp.content)
         id = data['id']
-        get_exp_url = "%s/explorations/%s" % (self.base_url, id)
-        data = requests.get(get_exp_url, headers = self.headers).json()
-        # Don't wait for computation because any explorations in the
-        #   data release should be cached and be available immediately.
-        if wait:
-            while not data['isComplete']:
-                time.sleep(1)
-                data = requests.get(get_exp_url, headers = self.headers).json()
-
-        return Exploration(attempt, data)
+        return "%s/explorations/%s" % (self.base_url, id)
+
+    def _wait_for_exploration(self, get_exp_url, data):
+        '''Polls until the exploration is complete, starting at
+            poll_initial_delay between polls and backing off to at most
+            poll_max_delay.'''
+        delay = self.poll_initial_delay
+        while not data['isComplete']:
+            metrics.registry.increment('codehunt_exploration_polls_total')
+            time.sleep(delay)
+            delay = min(delay * 2, self.poll_max_delay)
+            data = self._get_exploration(get_exp_url)
+        return data
+
+    def _get_exploration(self, get_exp_url):
+        resp = self._request('GET', 'explorations/id', get_exp_url)
+        resp.raise_for_status()
+        return json_loads(resp.content)
+
+    def explore_many(self, attempts, concurrency=8, wait=True, failed=None):
+        '''Explores many attempts with up to concurrency explorations in
+            flight at once. Yields Exploration objects in the order they
+            complete, which is not necessarily the order of attempts.
+
+            Attempts whose exploration fails with a requests.RequestException
+            (e.g. because the server kept throttling it) are logged and
+            skipped rather than ending the iteration; if failed is a list,
+            (attempt, exception) pairs for them are appended to it. Other
+            exceptions are raised.
+
+            The connection pool should be at least concurrency connections
+            (see pool_size) for the requests to actually overlap.'''
+        import requests
+
+        for attempt, future in map_concurrently(
+                lambda attempt: self.explore(attempt, wait),
+                attempts, concurrency):
+            try:
+                exploration = future.result()
+            except requests.RequestException as e:
+                logger.warning("Exploring %s failed: %s", attempt, e)
+                if failed is not None:
+                    failed.append((attempt, e))
+                continue
+            yield exploration
 
     def translate(self, attempt):
         '''Translates a Java program to C#. Note that the translation is very
@@ -247,12 +571,20 @@ class Client(object):
         if attempt.language != "Java":
             raise Exception("Can only translate Java programs.")
 
-        resp = requests.post("%s/translate?language=CSharp" % self.base_url,
-                             headers = self.headers,
-                data = json.dumps({
-                            'language': attempt.language,
-                            'text': attempt.text
-                    }))
-        data = resp.json()
+        def compute():
+            resp = self._request('POST', 'translate',
+                                 "%s/translate?language=CSharp" %
+                                 self.base_url,
+                    data = json.dumps({
+                                'language': attempt.language,
+                                'text': attempt.text
+                        }))
+            resp.raise_for_status()
+            return json_loads(resp.content)
+
+        key = None
+        if self.cache is not None:
+            key = result_key('translate', attempt.language, attempt.text)
+        data = self._cached(key, compute, lambda data: 'kind' in data)
 
         return Translation(attempt, data)
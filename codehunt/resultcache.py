@@ -0,0 +1,74 @@
+import hashlib
+import json
+import threading
+import zlib
+
+from codehunt import metrics
+
+
+schema = '''
+CREATE TABLE IF NOT EXISTS results (
+    key TEXT PRIMARY KEY,
+    value BLOB NOT NULL -- zlib-compressed JSON
+);
+'''
+
+def result_key(*parts):
+    '''Content hash identifying a request by everything its result depends
+        on, e.g. result_key('explore', language, text, challenge_id).'''
+    encoded = json.dumps(parts, separators=(',', ':')).encode('utf-8')
+    return hashlib.sha256(encoded).hexdigest()
+
+class ResultCache(object):
+    '''Persistent cache of REST API responses, stored as compressed JSON in a
+        SQLite file and keyed by result_key(). Safe to share between
+        threads. Pass one to codehunt.rest.Client(cache=...).'''
+
+    def __init__(self, filename):
+        import sqlite3
+
+        self.filename = filename
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        self._connection = sqlite3.connect(filename, check_same_thread=False)
+        self._connection.executescript(schema)
+
+    def __repr__(self):
+        return "%s.%s(%s)" % (type(self).__module__, type(self).__name__,
+                              repr(self.filename))
+
+    def __len__(self):
+        with self._lock:
+            return self._connection.execute(
+                    "SELECT COUNT(*) FROM results").fetchone()[0]
+
+    def close(self):
+        with self._lock:
+            self._connection.close()
+
+    def get(self, key):
+        '''Returns the decoded JSON value stored under key, or None.'''
+        with self._lock:
+            row = self._connection.execute(
+                    "SELECT value FROM results WHERE key = ?",
+                    (key,)).fetchone()
+            if row is None:
+                self.misses += 1
+                metrics.registry.increment('codehunt_result_cache_total',
+                                           result='miss')
+                return None
+            self.hits += 1
+        metrics.registry.increment('codehunt_result_cache_total',
+                                   result='hit')
+        return json.loads(zlib.decompress(row[0]).decode('utf-8'))
+
+    def put(self, key, value):
+        import sqlite3
+
+        blob = zlib.compress(json.dumps(value).encode('utf-8'))
+        with self._lock:
+            with self._connection:
+                self._connection.execute(
+                        "INSERT OR REPLACE INTO results VALUES (?, ?)",
+                        (key, sqlite3.Binary(blob)))
@@ -0,0 +1,274 @@
+'''Near-duplicate detection for attempt source texts.
+
+    Texts are normalized (comments and whitespace differences removed),
+    split into overlapping shingles of tokens and summarized by MinHash
+    signatures. Locality-sensitive hashing over bands of the signatures finds
+    candidate pairs without comparing every pair of texts, and byte-identical
+    normalized texts are matched exactly.
+
+        index = SimilarityIndex()
+        for attempt, text in data.load_texts():
+            index.add(attempt, text)
+        index.find_similar(attempt, threshold=0.9)
+        index.clusters(level, threshold=0.9)
+'''
+
+import collections
+import hashlib
+import itertools
+import random
+import re
+import zlib
+
+# Optional; speeds up computing signatures
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+comment_re = re.compile(r"//[^\n]*|/\*.*?\*/", re.DOTALL)
+token_re = re.compile(r"\w+|[^\w\s]")
+
+_mask64 = (1 << 64) - 1
+
+def normalize(text):
+    '''Removes comments and collapses whitespace.'''
+    return ' '.join(comment_re.sub(' ', text).split())
+
+def tokenize(text):
+    return token_re.findall(normalize(text))
+
+def shingles(tokens, size):
+    '''The set of hashes of all runs of size consecutive tokens.'''
+    if len(tokens) < size:
+        size = max(len(tokens), 1)
+    return set(zlib.crc32(' '.join(tokens[i:i + size]).encode('utf-8'))
+               for i in range(max(len(tokens) - size + 1, 1)))
+
+class SimilarityIndex(object):
+    '''Index of attempts by MinHash signature of their source text.
+
+        num_perm: signature length; more is more accurate but slower
+        bands: number of LSH bands; num_perm must be a multiple of it. Pairs
+            with Jaccard similarity above roughly (1/bands)**(bands/num_perm)
+            are likely to become candidates.
+        shingle_size: number of tokens per shingle
+    '''
+
+    # Bounds on the comparisons clusters() makes for each member of an LSH
+    #   bucket: members per cluster compared with, and in total. None
+    #   removes the bound.
+    samples_per_cluster = 8
+    max_comparisons = 64
+
+    def __init__(self, num_perm=64, bands=16, shingle_size=3, seed=1):
+        if num_perm % bands:
+            raise ValueError("num_perm must be a multiple of bands")
+        self.num_perm = num_perm
+        self.bands = bands
+        self.rows = num_perm // bands
+        self.shingle_size = shingle_size
+
+        # MinHash permutations are approximated by multiply-shift hashing:
+        #   h -> ((a * h + b) mod 2**64) >> 32 with a odd.
+        rng = random.Random(seed)
+        self._permutations = [(rng.getrandbits(64) | 1, rng.getrandbits(64))
+                              for _ in range(num_perm)]
+        if numpy is not None:
+            self._a = numpy.array([[a] for a, b in self._permutations],
+                                  dtype=numpy.uint64)
+            self._b = numpy.array([[b] for a, b in self._permutations],
+                                  dtype=numpy.uint64)
+
+        self.attempts = []
+        self.signatures = []
+        # Maps digest of normalized text to ids of attempts with that text
+        self._exact = {}
+        # Digest of the normalized text of each attempt, by id
+        self._digests = []
+        # Maps (band number, band of signature) to ids of attempts
+        self._buckets = {}
+
+    def __len__(self):
+        return len(self.attempts)
+
+    def signature(self, text):
+        '''MinHash signature of text, as a tuple of num_perm integers.'''
+        hashes = shingles(tokenize(text), self.shingle_size)
+        if numpy is not None:
+            values = numpy.array(list(hashes), dtype=numpy.uint64)
+            # uint64 arithmetic wraps around, which is the mod 2**64.
+            with numpy.errstate(over='ignore'):
+                permuted = (self._a * values + self._b) >> numpy.uint64(32)
+            return tuple(int(x) for x in permuted.min(axis=1))
+        return tuple(min(((a * h + b) & _mask64) >> 32 for h in hashes)
+                     for a, b in self._permutations)
+
+    def _digest(self, text):
+        return hashlib.sha1(normalize(text).encode('utf-8')).digest()
+
+    def _bands(self, signature):
+        rows = self.rows
+        return [(band, signature[band * rows:(band + 1) * rows])
+                for band in range(self.bands)]
+
+    def add(self, attempt, text=None):
+        '''Adds attempt to the index. text defaults to attempt.text.'''
+        if text is None:
+            text = attempt.text
+        id = len(self.attempts)
+        signature = self.signature(text)
+        self.attempts.append(attempt)
+        self.signatures.append(signature)
+        digest = self._digest(text)
+        self._digests.append(digest)
+        self._exact.setdefault(digest, []).append(id)
+        for band in self._bands(signature):
+            self._buckets.setdefault(band, []).append(id)
+        return id
+
+    def similarity(self, signature, other):
+        '''Estimated Jaccard similarity of the texts with two signatures.'''
+        return sum(1 for x, y in zip(signature, other) if x == y) \
+                / float(self.num_perm)
+
+    def _candidates(self, text, signature):
+        candidates = set(self._exact.get(self._digest(text), ()))
+        for band in self._bands(signature):
+            candidates.update(self._buckets.get(band, ()))
+        return candidates
+
+    def find_similar(self, attempt, threshold=0.8, text=None):
+        '''Returns (other attempt, estimated similarity) pairs for indexed
+            attempts whose texts are at least threshold similar to attempt's,
+            most similar first. Identical texts (after normalization) have
+            similarity 1.0. attempt itself is not included, nor are indexed
+            attempts equal to it (see AttemptBase.__eq__).'''
+        if text is None:
+            text = attempt.text
+        signature = self.signature(text)
+        exact = set(self._exact.get(self._digest(text), ()))
+
+        results = []
+        for id in self._candidates(text, signature):
+            other = self.attempts[id]
+            if other == attempt:
+                continue
+            if id in exact:
+                score = 1.0
+            else:
+                score = self.similarity(signature, self.signatures[id])
+            if score >= threshold:
+                results.append((other, score))
+        results.sort(key=lambda result: -result[1])
+        return results
+
+    def clusters(self, level=None, threshold=0.8):
+        '''Groups the indexed attempts (only those for level, if given) into
+            clusters of near-duplicates: attempts end up in the same cluster
+            if a chain of pairs at least threshold similar connects them.
+            Returns a list of lists of attempts, omitting attempts that are
+            not similar to any other.
+
+            This is an approximation with bounded effort. Only pairs that
+            share an LSH bucket are candidates, as in find_similar(). Within
+            a bucket each attempt is compared with at most
+            samples_per_cluster members of each cluster found so far and
+            max_comparisons members in total, so an attempt that is only
+            similar to members that were not compared with it is left out
+            of their cluster, and possibly out of the result. Set both
+            attributes to None to compare every pair of candidates, which
+            takes time quadratic in the size of the buckets.'''
+        ids = [id for id, attempt in enumerate(self.attempts)
+               if level is None or attempt.level is level]
+        wanted = set(ids)
+        parent = dict((id, id) for id in ids)
+
+        def find(id):
+            while parent[id] != id:
+                parent[id] = parent[parent[id]]
+                id = parent[id]
+            return id
+
+        def union(x, y):
+            x, y = find(x), find(y)
+            if x != y:
+                parent[max(x, y)] = min(x, y)
+
+        # Attempts with identical texts have identical signatures, so only
+        #   one of each needs comparing below.
+        representative = {}
+        for id in ids:
+            if id in representative:
+                continue
+            group = [other for other in self._exact[self._digests[id]]
+                     if other in wanted]
+            for other in group:
+                representative[other] = group[0]
+                union(group[0], other)
+
+        # Within each LSH bucket, members are not compared with every other
+        #   member but with up to samples_per_cluster members of each
+        #   cluster formed so far in the bucket, most recently joined
+        #   clusters first and at most max_comparisons times. Buckets of
+        #   near-duplicates hold few clusters, so this is close to linear
+        #   in their size rather than quadratic. The same members share
+        #   many buckets, so results of comparisons are kept.
+        signatures = self.signatures
+        compared = {}
+
+        def similar(x, y):
+            result = compared.get((x, y))
+            if result is None:
+                result = compared[(x, y)] = self.similarity(
+                        signatures[x], signatures[y]) >= threshold
+            return result
+
+        seen_bands = set()
+        for id in ids:
+            if representative[id] != id:
+                continue
+            for band in self._bands(signatures[id]):
+                if band in seen_bands:
+                    continue
+                seen_bands.add(band)
+                # Maps a member of each of the bucket's clusters to a
+                #   sample of that cluster, most recently joined last
+                samples = collections.OrderedDict()
+                for x in sorted(set(representative[other]
+                                    for other in self._buckets[band]
+                                    if other in wanted)):
+                    matched = None
+                    budget = self.max_comparisons
+                    for key in list(itertools.islice(reversed(samples),
+                                                     self.max_comparisons)):
+                        if budget is not None:
+                            if budget <= 0:
+                                break
+                            budget -= len(samples[key])
+                        sample = samples[key]
+                        if not any(similar(y, x) for y in sample):
+                            continue
+                        union(key, x)
+                        if matched is None:
+                            matched = sample
+                            if self.samples_per_cluster is None or \
+                                    len(sample) < self.samples_per_cluster:
+                                sample.append(x)
+                            del samples[key]
+                        else:
+                            # x links two clusters of the bucket.
+                            if self.samples_per_cluster is None:
+                                matched.extend(sample)
+                            else:
+                                matched.extend(sample[:self.samples_per_cluster
+                                                      - len(matched)])
+                            del samples[key]
+                    if matched is None:
+                        matched = [x]
+                    samples[matched[0]] = matched
+
+        clusters = {}
+        for id in ids:
+            clusters.setdefault(find(id), []).append(self.attempts[id])
+        return [cluster for cluster in clusters.values() if len(cluster) > 1]
@@ -0,0 +1,254 @@
+'''Local stand-in for the Code Hunt REST API, for exercising codehunt.rest
+    without credentials or network access. It implements the /token,
+    /explorations and /translate endpoints closely enough for Client, but
+    does not actually compile or explore anything.
+
+    Usage:
+        with StubServer() as server:
+            client = codehunt.rest.Client('id', 'secret',
+                                          base_url=server.base_url)
+'''
+
+import itertools
+import json
+import socket
+import sys
+import threading
+import time
+
+try:
+    from http.server import BaseHTTPRequestHandler, HTTPServer
+    from socketserver import ThreadingMixIn
+    from urllib.parse import urlparse
+except ImportError:
+    # Python 2.x
+    from BaseHTTPServer import BaseHTTPRequestHandler, HTTPServer
+    from SocketServer import ThreadingMixIn
+    from urlparse import urlparse
+
+
+class _ThreadingHTTPServer(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+
+    def handle_error(self, request, client_address):
+        # Clients going away mid-request is expected, e.g. when a batch run
+        #   is killed; don't print a traceback for it.
+        if not isinstance(sys.exc_info()[1], socket.error):
+            HTTPServer.handle_error(self, request, client_address)
+
+
+class _Handler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    # Headers and body are written separately; without this, keep-alive
+    #   connections stall on delayed ACKs.
+    disable_nagle_algorithm = True
+
+    def log_message(self, format, *args):
+        pass
+
+    def _send_json(self, status, obj, headers={}):
+        body = json.dumps(obj).encode('utf-8')
+        self.send_response(status)
+        for name, value in headers.items():
+            self.send_header(name, value)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _read_json(self):
+        return json.loads(self.body.decode('utf-8')) if self.body else None
+
+    def _handle(self, method):
+        # Always consume the body so the connection can be kept alive even
+        #   if the request is rejected.
+        length = int(self.headers.get('Content-Length') or 0)
+        self.body = self.rfile.read(length)
+        self.server.stub.handle(self, method)
+
+    def do_POST(self):
+        self._handle('POST')
+
+    def do_GET(self):
+        self._handle('GET')
+
+
+class StubServer(object):
+    '''Serves a fake Code Hunt REST API on 127.0.0.1 in a background thread.
+
+        latency: seconds to sleep before answering each request.
+        completion_polls: how many GETs of a new exploration return
+            isComplete=False before it completes.
+        token_lifetime: seconds until an issued token is rejected with 401.
+        max_in_flight: if given, requests arriving while this many others
+            are being served are rejected with 429, like a throttling
+            server. /token requests are never throttled.
+        retry_after: Retry-After header value sent with 429 responses.
+    '''
+
+    def __init__(self, latency=0.0, completion_polls=0, token_lifetime=3600,
+                 port=0, max_in_flight=None, retry_after=None):
+        self.latency = latency
+        self.completion_polls = completion_polls
+        self.token_lifetime = token_lifetime
+        self.max_in_flight = max_in_flight
+        self.retry_after = retry_after
+        # Maps endpoint name to number of requests served
+        self.request_counts = {}
+        self._in_flight = 0
+
+        self._lock = threading.Lock()
+        self._ids = itertools.count(1)
+        self._explorations = {}
+        # Maps issued tokens to their expiry times
+        self._tokens = {}
+        self._server = _ThreadingHTTPServer(('127.0.0.1', port), _Handler)
+        self._server.stub = self
+        self._thread = None
+
+    def __repr__(self):
+        return "%s.%s(%s)" % (type(self).__module__, type(self).__name__,
+                              repr(self.base_url))
+
+    @property
+    def base_url(self):
+        return 'http://127.0.0.1:%d/api' % self._server.server_address[1]
+
+    def start(self):
+        self._thread = threading.Thread(target=self._server.serve_forever)
+        self._thread.daemon = True
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+        self._thread.join()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc_info):
+        self.stop()
+
+    def _count(self, endpoint):
+        with self._lock:
+            self.request_counts[endpoint] = \
+                    self.request_counts.get(endpoint, 0) + 1
+
+    def handle(self, handler, method):
+        path = urlparse(handler.path).path
+        if path == '/api/token' or self.max_in_flight is None:
+            self._serve(handler, method, path)
+            return
+
+        with self._lock:
+            throttle = self._in_flight >= self.max_in_flight
+            if not throttle:
+                self._in_flight += 1
+        if throttle:
+            self._count('throttled')
+            headers = {}
+            if self.retry_after is not None:
+                headers['Retry-After'] = str(self.retry_after)
+            handler._send_json(429, {'error': 'Too many requests'}, headers)
+            return
+        try:
+            self._serve(handler, method, path)
+        finally:
+            with self._lock:
+                self._in_flight -= 1
+
+    def _serve(self, handler, method, path):
+        if self.latency:
+            threading.Event().wait(self.latency)
+
+        if method == 'POST' and path == '/api/token':
+            self._count('token')
+            handler._send_json(200, self.token())
+        elif not self.is_authorized(handler.headers.get('Authorization')):
+            self._count('unauthorized')
+            handler._send_json(401, {'error': 'Invalid or expired token'})
+        elif method == 'POST' and path == '/api/explorations':
+            self._count('explorations')
+            handler._send_json(200, self.start_exploration(
+                    handler._read_json()))
+        elif method == 'GET' and path.startswith('/api/explorations/'):
+            self._count('explorations/id')
+            exp = self.get_exploration(path[len('/api/explorations/'):])
+            if exp is None:
+                handler._send_json(404, {'error': 'Unknown exploration'})
+            else:
+                handler._send_json(200, exp)
+        elif method == 'POST' and path == '/api/translate':
+            self._count('translate')
+            handler._send_json(200, self.translate(handler._read_json()))
+        else:
+            handler._send_json(404, {'error': 'Not found'})
+
+    def token(self):
+        token = 'stub-token-%d' % next(self._ids)
+        with self._lock:
+            self._tokens[token] = time.time() + self.token_lifetime
+        return {
+                'access_token': token,
+                'token_type': 'bearer',
+                'expires_in': self.token_lifetime,
+                }
+
+    def is_authorized(self, authorization):
+        if not authorization or not authorization.startswith('Bearer '):
+            return False
+        with self._lock:
+            expires = self._tokens.get(authorization[len('Bearer '):])
+        return expires is not None and time.time() < expires
+
+    def start_exploration(self, request):
+        id = str(next(self._ids))
+        with self._lock:
+            self._explorations[id] = [self.completion_polls, request]
+        return {'id': id}
+
+    def get_exploration(self, id):
+        with self._lock:
+            entry = self._explorations.get(id)
+            if entry is None:
+                return None
+            if entry[0] > 0:
+                entry[0] -= 1
+                return {'id': id, 'isComplete': False, 'kind': 'TestCases',
+                        'hasWon': False, 'names': [], 'testCases': []}
+        return self.exploration_result(id, entry[1])
+
+    def exploration_result(self, id, request):
+        '''The completed exploration for a POST /explorations request body.
+            Programs mentioning "return" win; anything else fails one test.'''
+        if 'return' in request['program']['text']:
+            return {'id': id, 'isComplete': True, 'kind': 'TestCases',
+                    'hasWon': True, 'names': ['x', 'EXPECTED RESULT'],
+                    'testCases': [{
+                        'status': 'Success',
+                        'anyExceptionOrPathBoundsExceeded': False,
+                        'summary': '',
+                        'message': '',
+                        'exception': None,
+                        'stackTrace': None,
+                        'values': ['0', '0'],
+                    }]}
+        return {'id': id, 'isComplete': True, 'kind': 'TestCases',
+                'hasWon': False,
+                'names': ['x', 'EXPECTED RESULT', 'YOUR RESULT'],
+                'testCases': [{
+                    'status': 'Failure',
+                    'anyExceptionOrPathBoundsExceeded': False,
+                    'summary': 'Mismatch',
+                    'message': '',
+                    'exception': None,
+                    'stackTrace': None,
+                    'values': ['1', '1', '0'],
+                }]}
+
+    def translate(self, request):
+        return {'kind': 'Translated',
+                'program': {'language': 'CSharp',
+                            'text': '// translated\n' + request['text']}}
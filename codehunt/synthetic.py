@@ -0,0 +1,95 @@
+'''Generates synthetic data releases with the same layout and file naming as
+    the real Code Hunt data release, for benchmarking and for trying out code
+    without the real data.'''
+
+import datetime
+import os
+import random
+
+from codehunt.datarelease import tzinfo_utc
+
+
+def level_names(sectors, levels_per_sector):
+    return ["Sector%d-Level%d" % (sector, level)
+            for sector in range(1, sectors + 1)
+            for level in range(1, levels_per_sector + 1)]
+
+def _program_text(rng, language_ext, size, won):
+    '''Roughly size characters of plausible-looking Java or C# source.'''
+    if language_ext == 'java':
+        header = "public class Program {\n  public static int Puzzle(int x) {\n"
+    else:
+        header = "using System;\n\npublic class Program {\n" \
+                 "  public static int Puzzle(int x) {\n"
+    lines = [header]
+    length = len(header)
+    while length < size:
+        line = "    x = x %s %d;\n" % (rng.choice('+-*'), rng.randint(0, 99))
+        lines.append(line)
+        length += len(line)
+    # codehunt.stubserver treats programs containing "return" as winning.
+    lines.append("    return x;\n" if won else "    throw null;\n")
+    lines.append("  }\n}\n")
+    return ''.join(lines)
+
+def generate_release(directory, users=100, sectors=4, levels_per_sector=6,
+                     levels_per_user=None, attempts_per_level=5,
+                     text_size=400, seed=0):
+    '''Writes a synthetic data release to directory, which must not exist.
+
+        users: number of User directories
+        sectors, levels_per_sector: the levels in solutions/ (at most 9 each)
+        levels_per_user: how many levels each user attempted (default all)
+        attempts_per_level: the mean number of attempts per level attempted;
+            the actual numbers are skewed like the real data
+        text_size: approximate number of characters per source file
+        seed: seed for the random choices
+
+        Returns the number of attempt files written.'''
+    rng = random.Random(seed)
+    names = level_names(sectors, levels_per_sector)
+    if levels_per_user is None:
+        levels_per_user = len(names)
+
+    solutions = os.path.join(directory, "solutions")
+    os.makedirs(solutions)
+    for name in names:
+        with open(os.path.join(solutions, name + ".challengeId"), "w") as f:
+            f.write("synthetic-%s" % name)
+        with open(os.path.join(solutions, name + ".cs"), "w") as f:
+            f.write(_program_text(rng, 'cs', text_size, True))
+
+    count = 0
+    start = datetime.datetime(2014, 4, 1, tzinfo=tzinfo_utc)
+    for user_num in range(users):
+        user_directory = os.path.join(directory, "users",
+                                      "User%03d" % user_num)
+        os.makedirs(user_directory)
+        with open(os.path.join(user_directory, "experience"), "w") as f:
+            f.write(str(rng.randint(1, 3)))
+
+        timestamp = start + datetime.timedelta(seconds=rng.randint(0, 86400))
+        language_ext = rng.choice(['java', 'cs'])
+        for name in rng.sample(names, min(levels_per_user, len(names))):
+            level_directory = os.path.join(user_directory, name)
+            os.makedirs(level_directory)
+            # Geometric distribution with the requested mean, capped by the
+            #   three digit attempt numbers.
+            attempts = 1
+            while attempts < 999 and \
+                    rng.random() > 1.0 / attempts_per_level:
+                attempts += 1
+            won_level = rng.random() < 0.8
+            for attempt_num in range(attempts):
+                timestamp += datetime.timedelta(
+                        seconds=rng.randint(5, 600))
+                won = won_level and attempt_num == attempts - 1
+                filename = "attempt%03d-%s%s.%s" % (
+                        attempt_num,
+                        timestamp.strftime("%Y%m%d-%H%M%S"),
+                        "-winning%d" % rng.randint(1, 3) if won else "",
+                        language_ext)
+                with open(os.path.join(level_directory, filename), "w") as f:
+                    f.write(_program_text(rng, language_ext, text_size, won))
+                count += 1
+    return count
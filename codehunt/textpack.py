@@ -0,0 +1,202 @@
+'''All the texts of a data release packed into a single file, so that
+    reading them costs no system calls and a pass over the whole corpus
+    runs at memory speed. Pack a release once with
+
+        python -m codehunt pack RELEASE
+
+    (or pack_texts(Data(directory))) and then open it with
+    Data(directory, pack=True); Attempt.text, Level.challenge_text,
+    Level.challenge_id and User.experience are then read from a memory map
+    of the pack. PackedTextStore.read_bytes() and items() give the UTF-8
+    encoded texts as memoryviews, without copying or decoding them.
+
+    The pack is a snapshot of the release. By default (verify=True) every
+    read checks the size and modification time of the file against those
+    recorded in the pack, which costs one stat call, and files that changed
+    are read from the release instead; for an archive, the archive file
+    itself is checked once when the pack is opened. Pass verify=False to
+    skip the checks when the release is known not to change. Files that are
+    not in the pack are read from the release as usual.
+
+    File format: the magic bytes, the UTF-8 encoded texts one after the
+    other, a table of contents, and a trailer giving the offset and length
+    of the table of contents followed by the magic bytes again. The table of
+    contents is zlib-compressed JSON:
+        {"release": [size, mtime] of the archive file, or null,
+         "files": [[name, offset, length, size, mtime], ...]}
+    with name the path of the file relative to the release, separated by
+    "/", and size and mtime those of the file (null inside an archive).
+'''
+
+import json
+import logging
+import mmap
+import os
+import struct
+import zlib
+
+from codehunt import metrics
+
+
+logger = logging.getLogger(__name__)
+
+magic = b'CHTPACK2'
+_trailer = struct.Struct('<QQ8s')
+
+default_pack_filename = "codehunt-texts.pack"
+
+def default_pack_path(directory):
+    '''Where the pack of the release in directory (or in an archive file)
+        goes by default.'''
+    if os.path.isdir(directory):
+        return os.path.join(directory, default_pack_filename)
+    return "%s.%s" % (directory, default_pack_filename)
+
+def _release_files(data):
+    '''Yields the filenames of every text of data, in the order they are
+        usually read.'''
+    for level in data.levels:
+        yield level.challenge_id_filename
+        yield os.path.splitext(level.challenge_id_filename)[0] + ".cs"
+    seen_users = set()
+    for attempt in data.iter_attempts():
+        if attempt.user.directory not in seen_users:
+            seen_users.add(attempt.user.directory)
+            yield os.path.join(attempt.user.directory, "experience")
+        yield attempt.filename
+
+def _stat_key(filename):
+    '''What a file's pack entry is checked against.'''
+    metrics.registry.increment('codehunt_stat_total')
+    st = os.stat(filename)
+    return [st.st_size, st.st_mtime]
+
+def pack_texts(data, filename=None):
+    '''Writes the texts of data, a codehunt.datarelease.Data, to filename
+        (by default default_pack_path(data.directory)). Files that cannot be
+        read are left out. Returns the number of files packed.'''
+    if filename is None:
+        filename = default_pack_path(data.directory)
+    read_text = data.read_release_file
+    in_archive = data.archive is not None
+
+    contents = []
+    temporary = filename + '.tmp'
+    with open(temporary, 'wb') as f:
+        f.write(magic)
+        offset = len(magic)
+        for path in _release_files(data):
+            try:
+                # Stat first: a file changing while it is packed then looks
+                #   stale rather than fresh.
+                stat_key = [None, None] if in_archive else _stat_key(path)
+                text = read_text(path)
+            except (IOError, OSError, KeyError):
+                continue
+            if not isinstance(text, bytes):
+                text = text.encode('utf-8')
+            f.write(text)
+            relative = os.path.relpath(path, data.directory)
+            contents.append(['/'.join(relative.split(os.sep)), offset,
+                             len(text)] + stat_key)
+            offset += len(text)
+
+        table = zlib.compress(json.dumps({
+                'release': _stat_key(data.directory) if in_archive else None,
+                'files': contents,
+                }).encode('utf-8'))
+        f.write(table)
+        f.write(_trailer.pack(offset, len(table), magic))
+    os.rename(temporary, filename)
+    return len(contents)
+
+class PackedTextStore(object):
+    '''Read-only view of a pack written by pack_texts() for the release in
+        directory. fallback(filename) is called to read files that are not
+        in the pack, or that changed since it was written if verify is
+        True.'''
+
+    def __init__(self, filename, directory, fallback=None, verify=True):
+        self.filename = filename
+        self.directory = directory
+        self.fallback = fallback
+        self.verify = verify
+
+        self._file = open(filename, 'rb')
+        size = os.fstat(self._file.fileno()).st_size
+        if size < len(magic) + _trailer.size:
+            self._file.close()
+            raise ValueError("%s is not a text pack" % filename)
+        self._map = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+        self._view = memoryview(self._map)
+
+        table_offset, table_length, end_magic = \
+                _trailer.unpack(self._map[size - _trailer.size:])
+        if self._map[:len(magic)] != magic or end_magic != magic:
+            self.close()
+            raise ValueError("%s is not a text pack of this version; "
+                             "repack the release" % filename)
+        contents = json.loads(zlib.decompress(
+                self._map[table_offset:table_offset + table_length])
+                .decode('utf-8'))
+
+        # Maps filenames, as Data builds them, to (offset, length, size,
+        #   mtime)
+        self._entries = dict(
+                (os.path.join(directory, *entry[0].split('/')),
+                 tuple(entry[1:]))
+                for entry in contents['files'])
+        if verify and contents['release'] is not None and \
+                _stat_key(directory) != contents['release']:
+            logger.warning("%s changed since %s was written; not using it",
+                           directory, filename)
+            self._entries = {}
+
+    def __repr__(self):
+        return "%s.%s(%s, %s)" % (type(self).__module__, type(self).__name__,
+                                  repr(self.filename), repr(self.directory))
+
+    def __len__(self):
+        return len(self._entries)
+
+    def __contains__(self, filename):
+        return filename in self._entries
+
+    def close(self):
+        self._view.release()
+        self._map.close()
+        self._file.close()
+
+    def read_bytes(self, filename):
+        '''The UTF-8 encoded text of filename as a memoryview of the pack.
+            Raises KeyError if filename is not in the pack.'''
+        offset, length = self._entries[filename][:2]
+        return self._view[offset:offset + length]
+
+    def read_text(self, filename):
+        '''Reads filename from the pack, or with fallback if it is not in the
+            pack. Usable as the read_text of Level and User.'''
+        entry = self._entries.get(filename)
+        if entry is not None and self.verify and entry[2] is not None:
+            try:
+                fresh = _stat_key(filename) == list(entry[2:])
+            except OSError:
+                fresh = False
+            if not fresh:
+                entry = None
+        if entry is None:
+            if self.fallback is None:
+                raise KeyError(filename)
+            return self.fallback(filename)
+        offset, length = entry[:2]
+        data = self._map[offset:offset + length]
+        metrics.registry.increment('codehunt_pack_read_total')
+        return data if isinstance(data, str) else data.decode('utf-8')
+
+    def items(self):
+        '''Yields (filename, memoryview of UTF-8 text) for every file in the
+            pack, in the order they are stored.'''
+        for filename, entry in sorted(self._entries.items(),
+                                      key=lambda item: item[1]):
+            offset, length = entry[:2]
+            yield filename, self._view[offset:offset + length]
@@ -1,6 +1,16 @@
 #!/usr/bin/env python
 
-from distutils.core import setup
+try:
+    from setuptools import setup
+    # Installs a "codehunt" command running codehunt.cli.main()
+    extra_args = {
+            'entry_points': {
+                    'console_scripts': ['codehunt = codehunt.cli:main'],
+                },
+        }
+except ImportError:
+    from distutils.core import setup
+    extra_args = {}
 
 setup(name='Code Hunt Data Helper',
       version='1.0',
@@ -9,4 +19,5 @@ setup(name='Code Hunt Data Helper',
       author_email='perelman@cs.washington.edu',
       url='https://github.com/dperelman/codehunt-data-py',
       packages=['codehunt'],
+      **extra_args
      )